@@ -5,6 +5,10 @@ from flask_cors import CORS
 from flask_restful import Api
 
 from database.db import db, init_db
+from database.cache import init_cache
+from database.commands import init_commands
+from database.push import init_push
+from database.events import init_events
 from resources.routes import initialize_routes
 from flask_jwt_extended import JWTManager
 
@@ -57,6 +61,10 @@ def create_app(cfg):
             return send_from_directory(app.static_folder, 'index.html')
 
     init_db(app)
+    init_cache(app)
+    init_commands(app)
+    init_push(app)
+    init_events(app)
     initialize_routes(api)
 
     return app
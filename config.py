@@ -11,6 +11,41 @@ class Config(object):
     SCHEDULER_API_ENABLED = False
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Seconds to keep computed /home stats, 0 disables the cache
+    HOME_STATS_CACHE_TTL = 60
+    HOME_STATS_CACHE_SIZE = 256
+    # Dotted path to a custom cache backend class (see database/cache.py).
+    # Writes invalidate the cache of their own process only, with more
+    # workers the others serve old stats for up to HOME_STATS_CACHE_TTL
+    # unless the backend is shared
+    HOME_STATS_CACHE_BACKEND = None
+    # Rows per transaction of the nightly activity reset, None for one UPDATE
+    ACTIVITY_RESET_BATCH_SIZE = None
+    # Push events to Pusher, /events works without it
+    PUSHER_ENABLED = True
+    # Dotted path to the Pusher client class, None for the real client
+    PUSHER_CLIENT = None
+    # Pending Pusher events, more are dropped (see database/push.py)
+    PUSH_QUEUE_SIZE = 1000
+    PUSH_QUEUE_WORKERS = 2
+    # Events sent in one trigger_batch call, Pusher allows at most 10
+    PUSH_QUEUE_BATCH_SIZE = 10
+    # Retries of a failed batch, waiting PUSH_QUEUE_BACKOFF * 2^n seconds
+    PUSH_QUEUE_MAX_RETRIES = 3
+    PUSH_QUEUE_BACKOFF = 0.5
+    # Dotted path sharing /events between workers, None for one process
+    # only ('database.events.PostgresFanout' with more workers)
+    EVENT_FANOUT_BACKEND = None
+    # Open /events streams per process. Every stream holds a gunicorn
+    # thread, keep it well below --threads (Procfile) so the rest of the
+    # API is still served
+    EVENT_STREAM_MAX_CONNECTIONS = 8
+    # Events waiting for one /events client, more are dropped
+    EVENT_QUEUE_SIZE = 100
+    # Seconds between keepalive comments on idle /events streams
+    EVENT_STREAM_KEEPALIVE = 15
+    # Seconds a token from /events_token can open an /events stream
+    EVENT_STREAM_TOKEN_TTL = 60
 
 
 class LocalProductionConfig(Config):
@@ -25,6 +60,8 @@ class ProductionConfig(Config):
             uri = uri.replace("postgres://", "postgresql://", 1)
 
     SQLALCHEMY_DATABASE_URI = uri
+    # Gunicorn may start more workers (WEB_CONCURRENCY)
+    EVENT_FANOUT_BACKEND = 'database.events.PostgresFanout'
 
 
 class DevelopmentConfig(Config):
@@ -36,3 +73,4 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///testing.db'
     JWT_SECRET_KEY = 'secret-key'
+    PUSHER_CLIENT = 'database.push.FakePusher'
@@ -0,0 +1,46 @@
+from sqlalchemy import inspect, select, text
+from .db import db
+from .models import Attendance
+
+
+def remove_duplicate_attendances():
+    """Delete all but the latest (highest id) row of every (user_id, date).
+
+    Duplicates were possible while attendance was checked with a SELECT
+    before the INSERT. The caller commits. Returns the number of deleted
+    rows.
+    """
+    attendance = Attendance.__table__
+    newer = attendance.alias('newer')
+
+    has_newer = select(newer.c.id)\
+        .where(newer.c.user_id == attendance.c.user_id)\
+        .where(newer.c.date == attendance.c.date)\
+        .where(newer.c.id > attendance.c.id)\
+        .exists()
+
+    return db.session.execute(
+        attendance.delete().where(has_newer)).rowcount
+
+
+def create_attendance_unique_index():
+    """Add the (user_id, date) unique index to an existing attendance table.
+
+    create_all() does not change tables which already exist, but the
+    upsert of save_attendances needs the index. A unique index serves
+    ON CONFLICT like the constraint of new databases does. Duplicates
+    have to be removed first. Returns False if it was already there.
+    """
+    name = 'uq_attendance_user_id_date'
+    inspector = inspect(db.session.connection())
+
+    existing = {c['name'] for c in inspector.get_unique_constraints(
+        'attendance')}
+    existing |= {i['name'] for i in inspector.get_indexes('attendance')}
+    if name in existing:
+        return False
+
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS {} '
+        'ON attendance (user_id, date)'.format(name)))
+    return True
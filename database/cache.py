@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from werkzeug.utils import import_string
+from .db import db
+from .models import User, Attendance, Image, News
+import threading
+import time
+
+
+class CacheBackend(object):
+    """Interface every home stats cache backend has to implement"""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    """In-process LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class HomeStatsCache(object):
+    """Caches computed home stats per institution_id.
+
+    Entries are dropped whenever a committed session touched users,
+    attendances, images or news of the institution. Code writing those
+    tables with bulk statements (which skip ORM events) has to call
+    `invalidate` on its own.
+
+    Every invalidation bumps the generation of the institution, a result
+    computed while the generation changed may miss the write and is not
+    stored. Invalidation reaches only this process: with the default
+    LRU backend other workers keep their entries until the TTL ends.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        ttl = app.config.get('HOME_STATS_CACHE_TTL', 60)
+        backend = app.config.get('HOME_STATS_CACHE_BACKEND')
+
+        if not ttl:
+            self.backend = None
+        elif backend is not None:
+            self.backend = import_string(backend)()
+        else:
+            self.backend = LRUCacheBackend(
+                app.config.get('HOME_STATS_CACHE_SIZE', 256), ttl)
+
+    def get_or_compute(self, institution_id, compute):
+        if self.backend is None:
+            return compute(institution_id)
+
+        result = self.backend.get(institution_id)
+        if result is None:
+            generation = self._generations.get(institution_id, 0)
+            result = compute(institution_id)
+
+            with self._lock:
+                if self._generations.get(institution_id, 0) == generation:
+                    self.backend.set(institution_id, result)
+
+        return result
+
+    def invalidate(self, institution_id):
+        if self.backend is not None:
+            with self._lock:
+                self._generations[institution_id] = \
+                    self._generations.get(institution_id, 0) + 1
+                self.backend.delete(institution_id)
+
+
+home_stats_cache = HomeStatsCache()
+
+
+def _old_values(obj, attribute):
+    # History is still there in after_flush
+    return inspect(obj).attrs[attribute].history.deleted
+
+
+def _changed_institutions(session):
+    institutions = set()
+    attendance_user_ids = set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        # Old values count too, a user can move to another institution
+        if isinstance(obj, (User, Image, News)):
+            institutions.add(obj.institution_id)
+            institutions.update(_old_values(obj, 'institution_id'))
+        elif isinstance(obj, Attendance):
+            attendance_user_ids.add(obj.user_id)
+            attendance_user_ids.update(_old_values(obj, 'user_id'))
+
+    if attendance_user_ids:
+        rows = session.query(User.institution_id)\
+            .filter(User.id.in_(attendance_user_ids)).all()
+        institutions.update(row.institution_id for row in rows)
+
+    institutions.discard(None)
+    return institutions
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_home_stats_changes(session, flush_context):
+    if home_stats_cache.backend is None:
+        return
+
+    pending = session.info.setdefault('home_stats_invalidate', set())
+    pending.update(_changed_institutions(session))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_home_stats(session):
+    for institution_id in session.info.pop('home_stats_invalidate', ()):
+        home_stats_cache.invalidate(institution_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_home_stats_changes(session):
+    session.info.pop('home_stats_invalidate', None)
+
+
+def init_cache(app):
+    home_stats_cache.init_app(app)
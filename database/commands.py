@@ -0,0 +1,127 @@
+from flask.cli import with_appcontext
+from .db import db
+from .attendance import (
+    create_attendance_unique_index, remove_duplicate_attendances
+)
+from .conversations import (
+    fill_conversation_pairs, migrate_participants, refresh_last_replies,
+    refresh_unread_counts
+)
+from .models import User
+from .reply_search import create_reply_search
+from .rollup import refresh_attendance_rollup
+from .schema import upgrade_schema
+import click
+
+
+@click.command('upgrade-schema')
+@with_appcontext
+def upgrade_schema_command():
+    """Add new columns and indexes to tables of an older database"""
+    with db.engine.begin() as connection:
+        added = upgrade_schema(connection)
+
+    click.echo('Added: {}'.format(', '.join(added) if added else 'nothing'))
+
+
+@click.command('add-attendance-unique-index')
+@with_appcontext
+def add_attendance_unique_index_command():
+    """Remove duplicate attendances and add the (user_id, date) index"""
+    removed = remove_duplicate_attendances()
+    created = create_attendance_unique_index()
+
+    # The rollup counted the removed rows
+    if removed:
+        refresh_attendance_rollup()
+    db.session.commit()
+
+    click.echo('Removed {} duplicate attendances, index {}'.format(
+        removed, 'created' if created else 'already exists'))
+
+
+@click.command('rebuild-attendance-rollup')
+@click.option('--institution-id', type=int, default=None,
+              help='Only rebuild given institution')
+@with_appcontext
+def rebuild_attendance_rollup_command(institution_id):
+    """Rebuild attendance_daily from the attendance table"""
+    refresh_attendance_rollup(institution_id)
+    db.session.commit()
+
+    click.echo('Attendance rollup rebuilt')
+
+
+@click.command('backfill-conversation-last-reply')
+@with_appcontext
+def backfill_conversation_last_reply_command():
+    """Fill last reply columns of conversations from their replies"""
+    refresh_last_replies()
+    db.session.commit()
+
+    click.echo('Conversation last replies filled')
+
+
+@click.command('migrate-conversation-participants')
+@with_appcontext
+def migrate_conversation_participants_command():
+    """Fill conversation_participant from user_one and user_two"""
+    count = migrate_participants()
+    db.session.commit()
+
+    click.echo('Added {} conversation participants'.format(count))
+
+
+@click.command('backfill-conversation-unread')
+@with_appcontext
+def backfill_conversation_unread_command():
+    """Count unread replies of conversation participants"""
+    refresh_unread_counts()
+    db.session.commit()
+
+    click.echo('Conversation unread counts filled')
+
+
+@click.command('backfill-user-search')
+@with_appcontext
+def backfill_user_search_command():
+    """Fill the folded name columns used by user search"""
+    count = 0
+    for user in User.query.order_by(User.id).yield_per(1000):
+        user.update_search_names()
+        count += 1
+    db.session.commit()
+
+    click.echo('Search names of {} users filled'.format(count))
+
+
+@click.command('create-reply-search-index')
+@with_appcontext
+def create_reply_search_index_command():
+    """Create the full-text index of conversation replies"""
+    with db.engine.begin() as connection:
+        create_reply_search(connection)
+
+    click.echo('Reply search index created')
+
+
+@click.command('backfill-conversation-pairs')
+@with_appcontext
+def backfill_conversation_pairs_command():
+    """Fill the user pair of two person conversations"""
+    count = fill_conversation_pairs()
+    db.session.commit()
+
+    click.echo('Pairs of {} conversations filled'.format(count))
+
+
+def init_commands(app):
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(add_attendance_unique_index_command)
+    app.cli.add_command(rebuild_attendance_rollup_command)
+    app.cli.add_command(backfill_conversation_last_reply_command)
+    app.cli.add_command(migrate_conversation_participants_command)
+    app.cli.add_command(backfill_conversation_unread_command)
+    app.cli.add_command(backfill_user_search_command)
+    app.cli.add_command(create_reply_search_index_command)
+    app.cli.add_command(backfill_conversation_pairs_command)
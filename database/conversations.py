@@ -0,0 +1,119 @@
+from sqlalchemy import func, or_, select, true, union
+from .db import db, upsert_from_select
+from .models import Conversation, ConversationParticipant, ConversationReply
+
+
+def refresh_last_replies():
+    """Recompute the last reply columns of every conversation.
+
+    Only needed for data written before these columns existed or by hand,
+    ConversationReplyApi keeps them up to date. The copy of last_reply_at
+    on the participants is refreshed too. The caller commits.
+    """
+    conversation = Conversation.__table__
+    reply = ConversationReply.__table__
+
+    last_reply_id = select(reply.c.id)\
+        .where(reply.c.conv_id == conversation.c.id)\
+        .order_by(reply.c.reply_time.desc(), reply.c.id.desc())\
+        .limit(1)\
+        .scalar_subquery()
+    db.session.execute(
+        conversation.update().values(last_reply_id=last_reply_id))
+
+    def last_reply_column(column):
+        return select(column)\
+            .where(reply.c.id == conversation.c.last_reply_id)\
+            .scalar_subquery()
+
+    db.session.execute(conversation.update().values(
+        last_reply_at=func.coalesce(
+            last_reply_column(reply.c.reply_time), conversation.c.created_at),
+        last_reply_user_id=last_reply_column(reply.c.reply_user_id),
+        last_reply_preview=last_reply_column(
+            func.substr(reply.c.reply, 1, Conversation.PREVIEW_LENGTH))))
+
+    participant = ConversationParticipant.__table__
+    db.session.execute(participant.update().values(
+        last_reply_at=select(conversation.c.last_reply_at)
+        .where(conversation.c.id == participant.c.conversation_id)
+        .scalar_subquery()))
+
+
+def migrate_participants():
+    """Add participant rows for users of two person conversations.
+
+    Rows which already exist are left alone, so it is safe to run more
+    than once. The caller commits. Returns the number of added rows.
+    """
+    conversation = Conversation.__table__
+
+    participants = union(
+        select(conversation.c.id, conversation.c.user_one,
+               conversation.c.last_reply_at)
+        .where(conversation.c.user_one.isnot(None)),
+        select(conversation.c.id, conversation.c.user_two,
+               conversation.c.last_reply_at)
+        .where(conversation.c.user_two.isnot(None)))
+
+    return db.session.execute(upsert_from_select(
+        ConversationParticipant,
+        ['conversation_id', 'user_id', 'last_reply_at'],
+        select(participants.subquery()).where(true()),
+        ['conversation_id', 'user_id'])).rowcount
+
+
+def refresh_unread_counts():
+    """Recompute unread_count of every participant from the replies.
+
+    Counts replies of other users sent after last_read_at of the
+    participant, all of them if the conversation was never read. Only
+    needed once for existing data. The caller commits.
+    """
+    participant = ConversationParticipant.__table__
+    reply = ConversationReply.__table__
+
+    unread = select(func.count(reply.c.id))\
+        .where(reply.c.conv_id == participant.c.conversation_id)\
+        .where(reply.c.reply_user_id != participant.c.user_id)\
+        .where(or_(participant.c.last_read_at.is_(None),
+                   reply.c.reply_time > participant.c.last_read_at))\
+        .scalar_subquery()
+
+    db.session.execute(participant.update().values(unread_count=unread))
+
+
+def fill_conversation_pairs():
+    """Fill pair_low and pair_high of two person conversations.
+
+    If the same users have more conversations (possible before the
+    unique index), only the oldest one gets the pair, the others stay
+    reachable from the inbox. The caller commits.
+    """
+    conversation = Conversation.__table__
+    older = conversation.alias('older')
+
+    # Scalar min() and max() are least() and greatest() in PostgreSQL
+    if db.engine.dialect.name == 'postgresql':
+        smaller, bigger = func.least, func.greatest
+    else:
+        smaller, bigger = func.min, func.max
+
+    def pair(table):
+        return (smaller(table.c.user_one, table.c.user_two),
+                bigger(table.c.user_one, table.c.user_two))
+
+    low, high = pair(conversation)
+    older_low, older_high = pair(older)
+
+    has_older = select(older.c.id)\
+        .where(older_low == low)\
+        .where(older_high == high)\
+        .where(older.c.id < conversation.c.id)\
+        .exists()
+
+    return db.session.execute(conversation.update()
+                              .where(conversation.c.user_two.isnot(None))
+                              .where(conversation.c.pair_low.is_(None))
+                              .where(~has_older)
+                              .values(pair_low=low, pair_high=high)).rowcount
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 import pusher
 
 db = SQLAlchemy()
@@ -15,3 +16,58 @@ def init_db(app):
         db.init_app(app)
         db.create_all()
 
+
+def _insert(model):
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model.__table__)
+
+    return sqlite.insert(model.__table__)
+
+
+def _on_conflict(stmt, index_elements, update_columns):
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns})
+
+
+def upsert(model, rows, index_elements, update_columns=None):
+    """Build a multi-row INSERT ... ON CONFLICT statement for `model`.
+
+    Conflicts on `index_elements` (which need a unique index) update
+    `update_columns` from the inserted row, or are skipped when no
+    columns are given. Works on both PostgreSQL and SQLite.
+    """
+    stmt = _insert(model).values(rows)
+    return _on_conflict(stmt, index_elements, update_columns)
+
+
+def insert_ids(model, rows):
+    """Insert `rows` of `model` with one multi-row INSERT.
+
+    Returns the ids of the new rows in the order of `rows`, both
+    databases number the rows of one INSERT in the order of its VALUES.
+    PostgreSQL sends them with RETURNING, the SQLite dialect of
+    SQLAlchemy 1.4 cannot, so they are counted back from the last id.
+    """
+    table = model.__table__
+    stmt = table.insert().values(rows)
+
+    if db.engine.dialect.name == 'postgresql':
+        result = db.session.execute(stmt.returning(table.c.id))
+        return sorted(row.id for row in result)
+
+    last_id = db.session.execute(stmt).lastrowid
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def upsert_from_select(model, columns, select, index_elements,
+                       update_columns=None):
+    """Same as `upsert`, but inserts the rows returned by `select`
+
+    SQLite needs the select to have a WHERE clause to parse the upsert.
+    """
+    stmt = _insert(model).from_select(columns, select)
+    return _on_conflict(stmt, index_elements, update_columns)
@@ -0,0 +1,194 @@
+from werkzeug.utils import import_string
+from sqlalchemy import text
+from .db import db
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LocalFanout(object):
+    """Delivers events to subscribers of this process only.
+
+    Enough for a single worker. With more workers (or machines) every
+    subscriber has to be reached, use `PostgresFanout` then.
+    """
+
+    def start(self, hub):
+        pass
+
+    def publish(self, hub, message):
+        hub.dispatch(message)
+
+
+class PostgresFanout(object):
+    """Shares events between workers with PostgreSQL LISTEN/NOTIFY.
+
+    Events are sent with pg_notify and every process listening on the
+    channel, the sending one included, dispatches them to its own
+    subscribers. NOTIFY payloads are limited to 8000 bytes.
+    """
+
+    CHANNEL = 'conversation_events'
+
+    def __init__(self):
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def start(self, hub):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, args=(hub, db.engine.url),
+                    daemon=True)
+                self._listener.start()
+
+    def publish(self, hub, message):
+        with db.engine.begin() as connection:
+            connection.execute(
+                text('SELECT pg_notify(:channel, :payload)'),
+                {'channel': self.CHANNEL, 'payload': json.dumps(message)})
+
+    def _listen(self, hub, url):
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            try:
+                connection = psycopg2.connect(url.set(
+                    drivername='postgresql').render_as_string(
+                        hide_password=False))
+                connection.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute('LISTEN ' + self.CHANNEL)
+
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        hub.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception('Lost LISTEN connection, reconnecting')
+                time.sleep(1)
+
+
+class Subscription(object):
+    """Events of one channel waiting to be read by one client"""
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.queue = queue.Queue(size)
+
+    def get(self, timeout):
+        """Return the next event or None after `timeout` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub(object):
+    """In-process publish/subscribe of realtime events.
+
+    Channels are named by user id, like the Pusher channels. A slow
+    client whose queue is full loses events instead of blocking the
+    publisher. At most `max_subscriptions` clients are subscribed at once,
+    every one of them holds a server thread.
+    """
+
+    def __init__(self):
+        self.fanout = LocalFanout()
+        self.queue_size = 100
+        self.max_subscriptions = 8
+        self._subscriptions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        fanout = app.config.get('EVENT_FANOUT_BACKEND')
+        if fanout is None:
+            # Gunicorn (and Heroku) start WEB_CONCURRENCY processes
+            if int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+                raise RuntimeError('EVENT_FANOUT_BACKEND must be set when '
+                                   'running more than one worker')
+
+            self.fanout = LocalFanout()
+        else:
+            self.fanout = import_string(fanout)()
+
+        self.queue_size = app.config.get('EVENT_QUEUE_SIZE', 100)
+        self.max_subscriptions = app.config.get(
+            'EVENT_STREAM_MAX_CONNECTIONS', 8)
+
+    def subscribe(self, channel):
+        """Return a new Subscription or None if there are too many"""
+        with self._lock:
+            if self._count >= self.max_subscriptions:
+                return None
+
+            subscription = Subscription(channel, self.queue_size)
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+            self._count += 1
+
+        self.fanout.start(self)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            if subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def publish(self, channels, event_name, data):
+        """Send `event_name` with `data` to subscribers of `channels`.
+
+        Best effort like the push queue: callers publish after their
+        commit, so a failing fanout is logged instead of raised.
+        """
+        if isinstance(channels, str):
+            channels = [channels]
+
+        try:
+            self.fanout.publish(self, {
+                'channels': list(channels),
+                'name': event_name,
+                'data': data
+            })
+        except Exception:
+            logger.exception('Could not publish %s to %d channels',
+                             event_name, len(channels))
+
+    def dispatch(self, message):
+        """Hand a published message to subscribers of this process"""
+        event = {'name': message['name'], 'data': message['data']}
+
+        with self._lock:
+            subscriptions = [
+                subscription
+                for channel in message['channels']
+                for subscription in self._subscriptions.get(channel, ())]
+
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                logger.warning('Event queue of channel %s is full',
+                               subscription.channel)
+
+
+event_hub = EventHub()
+
+
+def init_events(app):
+    event_hub.init_app(app)
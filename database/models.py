@@ -1,4 +1,6 @@
+from sqlalchemy import event
 from .db import db
+from .search import fold
 import datetime
 import time
 
@@ -38,6 +40,14 @@ class Role(db.Model):
 
 
 class User(db.Model):
+    __table_args__ = (
+        # Prefix search of names within an institution (UserSearchApi)
+        db.Index('ix_user_institution_id_search_first_last',
+                 'institution_id', 'search_first_last'),
+        db.Index('ix_user_institution_id_search_last_first',
+                 'institution_id', 'search_last_first'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(40), nullable=False)
     password = db.Column(db.String(64), nullable=False)
@@ -50,8 +60,16 @@ class User(db.Model):
                            default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, nullable=False,
                            default=db.func.current_timestamp())
+    # Folded (see database/search.py) "firstname surname" and
+    # "surname firstname", kept up to date on every insert and update.
+    # Binary collation, so prefix ranges match what the index orders by.
+    search_first_last = db.Column(db.String(128).with_variant(
+        db.String(128, collation='C'), 'postgresql'), nullable=True)
+    search_last_first = db.Column(db.String(128).with_variant(
+        db.String(128, collation='C'), 'postgresql'), nullable=True)
 
-    institution_id = db.Column(db.Integer, db.ForeignKey('institution.id'))
+    institution_id = db.Column(
+        db.Integer, db.ForeignKey('institution.id'), index=True)
 
     roles = db.relationship('Role', secondary=user_roles,
                             backref=db.backref('users', lazy='dynamic'))
@@ -75,6 +93,18 @@ class User(db.Model):
         self.created_at = created_at
         self.updated_at = updated_at
 
+    def update_search_names(self):
+        self.search_first_last = fold(
+            '{} {}'.format(self.firstname, self.surname))
+        self.search_last_first = fold(
+            '{} {}'.format(self.surname, self.firstname))
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _update_user_search_names(mapper, connection, user):
+    user.update_search_names()
+
 
 class Institution(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -101,6 +131,10 @@ class Institution(db.Model):
 
 
 class Group(db.Model):
+    __table_args__ = (
+        db.Index('ix_group_institution_id_name', 'institution_id', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False,
@@ -120,7 +154,7 @@ class Activity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sleep = db.Column(db.Integer, nullable=False)
     food_scale = db.Column(db.Integer, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
     activity_user = db.relationship(
         'User', backref='activity_test', lazy=True, uselist=False)
@@ -131,6 +165,27 @@ class Activity(db.Model):
         # self.user_id = user_id
 
 
+class ActivityHistory(db.Model):
+    """Daily snapshot of an Activity, taken before the nightly reset"""
+    __tablename__ = 'activity_history'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'date',
+                            name='uq_activity_history_user_id_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    sleep = db.Column(db.Integer, nullable=False)
+    food_scale = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, user_id, date, sleep, food_scale):
+        self.user_id = user_id
+        self.date = date
+        self.sleep = sleep
+        self.food_scale = food_scale
+
+
 class DishMenu(db.Model):
     __tablename__ = 'dishmenu'
     id = db.Column(db.Integer, primary_key=True)
@@ -164,17 +219,44 @@ class Dish(db.Model):
 
 
 class Conversation(db.Model):
+    __table_args__ = (
+        # One conversation per pair of users, NULL for group conversations
+        db.UniqueConstraint('pair_low', 'pair_high',
+                            name='uq_conversation_pair'),
+    )
+
+    PREVIEW_LENGTH = 100
+
     id = db.Column(db.Integer, primary_key=True)
+    # Two-person conversations keep both users here as well, group
+    # conversations only have their creator in user_one. Members of
+    # every conversation are in conversation_participant.
     user_one = db.Column(db.Integer, db.ForeignKey('user.id'))
     user_two = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Smaller and bigger id of user_one and user_two, whichever started
+    # the conversation
+    pair_low = db.Column(db.Integer, nullable=True)
+    pair_high = db.Column(db.Integer, nullable=True)
+    title = db.Column(db.String(45), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False,
                            default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, nullable=False,
                            default=db.func.current_timestamp())
 
+    # Copy of the last reply, kept up to date by ConversationReplyApi.
+    # last_reply_at is the creation time until the first reply.
+    last_reply_id = db.Column(db.Integer, nullable=True)
+    last_reply_at = db.Column(db.DateTime, nullable=True)
+    last_reply_user_id = db.Column(db.Integer, nullable=True)
+    last_reply_preview = db.Column(db.String(PREVIEW_LENGTH), nullable=True)
+
     conversation_replies = db.relationship('ConversationReply',
                                            backref='conversation', lazy=True)
 
+    participants = db.relationship('ConversationParticipant',
+                                   backref='conversation', lazy=True,
+                                   cascade="all,delete-orphan")
+
     user_two_obj = db.relationship(
         'User', backref='conversationes2', foreign_keys=user_two, lazy=True)
 
@@ -183,9 +265,47 @@ class Conversation(db.Model):
         self.user_two = user_two
         self.created_at = created_at
         self.updated_at = updated_at
+        self.last_reply_at = created_at
+
+        if user_two is not None:
+            self.pair_low, self.pair_high = sorted((user_one, user_two))
+
+
+class ConversationParticipant(db.Model):
+    __tablename__ = 'conversation_participant'
+    __table_args__ = (
+        # Inbox of an user in the order it is shown, the primary key
+        # serves lookups by conversation
+        db.Index('ix_conversation_participant_user_id_last_reply_at',
+                 'user_id', 'last_reply_at', 'conversation_id'),
+    )
+
+    conversation_id = db.Column(db.Integer, db.ForeignKey(
+        'conversation.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), primary_key=True)
+    last_read_at = db.Column(db.DateTime, nullable=True)
+    # Copy of Conversation.last_reply_at, so the inbox is read in index
+    # order. Kept by record_replies (resources/conversations.py)
+    last_reply_at = db.Column(db.DateTime, nullable=True)
+    # Replies of other users since last_read_at, kept by ConversationReplyApi
+    unread_count = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+
+    def __init__(self, conversation_id, user_id, last_reply_at=None):
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.last_reply_at = last_reply_at
+        self.unread_count = 0
 
 
 class ConversationReply(db.Model):
+    __table_args__ = (
+        # Keyset pagination of replies in a conversation
+        db.Index('ix_conversation_reply_conv_id_reply_time_id',
+                 'conv_id', 'reply_time', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     reply = db.Column(db.String(512), nullable=False)
     reply_time = db.Column(db.DateTime, nullable=False,
@@ -278,6 +398,14 @@ class Album(db.Model):
 
 
 class Attendance(db.Model):
+    # The unique constraint also serves every lookup by user_id
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'date',
+                            name='uq_attendance_user_id_date'),
+        # Keyset pagination of date ranges
+        db.Index('ix_attendance_date_id', 'date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     present = db.Column(db.Integer, nullable=False)
@@ -292,6 +420,31 @@ class Attendance(db.Model):
         self.user_id = user_id
 
 
+class AttendanceDaily(db.Model):
+    """Attendance counts per day, see database/rollup.py"""
+    __tablename__ = 'attendance_daily'
+    __table_args__ = (
+        db.UniqueConstraint('institution_id', 'group_id', 'date',
+                            name='uq_attendance_daily_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    institution_id = db.Column(db.Integer, db.ForeignKey(
+        'institution.id'), nullable=False)
+    # 0 holds the counts of the whole institution
+    group_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    present_count = db.Column(db.Integer, nullable=False)
+    absent_count = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, institution_id, group_id, date, present_count, absent_count):
+        self.institution_id = institution_id
+        self.group_id = group_id
+        self.date = date
+        self.present_count = present_count
+        self.absent_count = absent_count
+
+
 # class PickUpDelay(db.Model)
 #    id = db.Column(db.Integer, primary_key=True)
 #    is_delayed = db.Column(db.Integer, nullable=False)
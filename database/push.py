@@ -0,0 +1,157 @@
+from werkzeug.utils import import_string
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FakePusher(object):
+    """Pusher client that keeps triggered events in memory, for tests"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def trigger(self, channels, event_name, data):
+        if isinstance(channels, str):
+            channels = [channels]
+
+        self.trigger_batch([
+            {'channel': channel, 'name': event_name, 'data': data}
+            for channel in channels])
+
+    def trigger_batch(self, batch):
+        with self._lock:
+            self.events.extend(batch)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+
+class PushQueue(object):
+    """Delivers Pusher events from a bounded queue in worker threads.
+
+    `publish` only puts events on the queue, so requests do not wait for
+    Pusher. Workers send the waiting events together with `trigger_batch`
+    and retry failed batches with exponential backoff. Events are dropped
+    when the queue is full or a batch keeps failing, and counted in
+    `stats`. The queue lives in memory, pending events are lost on restart.
+    """
+
+    # Pusher accepts at most 10 events in one batch
+    MAX_BATCH_SIZE = 10
+
+    def __init__(self):
+        self.enabled = True
+        self.client = None
+        self.queue = None
+        self.workers = []
+        self._lock = threading.Lock()
+        self._counters = {'sent': 0, 'dropped': 0, 'failed': 0, 'retried': 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PUSHER_ENABLED', True)
+
+        client = app.config.get('PUSHER_CLIENT')
+        if client is None:
+            from .db import pusher_client
+            self.client = pusher_client
+        else:
+            self.client = import_string(client)()
+
+        self.worker_count = app.config.get('PUSH_QUEUE_WORKERS', 2)
+        self.batch_size = min(app.config.get('PUSH_QUEUE_BATCH_SIZE', 10),
+                              self.MAX_BATCH_SIZE)
+        self.max_retries = app.config.get('PUSH_QUEUE_MAX_RETRIES', 3)
+        self.backoff = app.config.get('PUSH_QUEUE_BACKOFF', 0.5)
+
+        with self._lock:
+            if self.queue is None:
+                self.queue = queue.Queue(
+                    app.config.get('PUSH_QUEUE_SIZE', 1000))
+
+    def publish(self, channels, event_name, data):
+        """Queue `event_name` with `data` for every channel in `channels`"""
+        if not self.enabled:
+            return
+
+        if isinstance(channels, str):
+            channels = [channels]
+
+        self._start_workers()
+
+        for channel in channels:
+            try:
+                self.queue.put_nowait(
+                    {'channel': channel, 'name': event_name, 'data': data})
+            except queue.Full:
+                self._count('dropped')
+                logger.warning('Push queue is full, dropped event for '
+                               'channel %s', channel)
+
+    def join(self):
+        """Wait until every queued event was sent or dropped"""
+        self.queue.join()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+
+        result['depth'] = self.queue.qsize() if self.queue else 0
+        result['workers'] = len(self.workers)
+        return result
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def _start_workers(self):
+        # Started on first use, so forking servers start them in workers
+        with self._lock:
+            while len(self.workers) < self.worker_count:
+                worker = threading.Thread(target=self._work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+
+            # Coalesce whatever is already waiting into one request
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._send(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _send(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.trigger_batch(batch)
+            except Exception:
+                if attempt == self.max_retries:
+                    self._count('failed', len(batch))
+                    logger.exception('Could not push %d events', len(batch))
+                    return
+
+                self._count('retried')
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self._count('sent', len(batch))
+                return
+
+
+push_queue = PushQueue()
+
+
+def init_push(app):
+    push_queue.init_app(app)
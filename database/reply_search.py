@@ -0,0 +1,122 @@
+from sqlalchemy import (
+    DDL, Float, cast, column, event, func, literal_column, table, text
+)
+from .db import db
+from .models import ConversationReply
+import html
+
+# PostgreSQL searches an expression GIN index, SQLite (development and
+# tests) an FTS5 table kept in sync with conversation_reply by triggers.
+# Neither can be declared on the model, so they are created right after
+# the table. For existing databases run `flask create-reply-search-index`.
+
+FTS_TABLE = 'conversation_reply_fts'
+
+# The database marks matched words with these control characters, so the
+# snippet can be escaped before they become <em> and </em> (see highlight)
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+_POSTGRESQL_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_conversation_reply_reply_tsv "
+    "ON conversation_reply USING gin (to_tsvector('simple', reply))",
+]
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversation_reply_fts USING fts5("
+    "reply, content='conversation_reply', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS conversation_reply_fts_insert "
+    "AFTER INSERT ON conversation_reply BEGIN "
+    "INSERT INTO conversation_reply_fts(rowid, reply) "
+    "VALUES (new.id, new.reply); END",
+    "CREATE TRIGGER IF NOT EXISTS conversation_reply_fts_delete "
+    "AFTER DELETE ON conversation_reply BEGIN "
+    "INSERT INTO conversation_reply_fts(conversation_reply_fts, rowid, reply) "
+    "VALUES ('delete', old.id, old.reply); END",
+    "CREATE TRIGGER IF NOT EXISTS conversation_reply_fts_update "
+    "AFTER UPDATE OF reply ON conversation_reply BEGIN "
+    "INSERT INTO conversation_reply_fts(conversation_reply_fts, rowid, reply) "
+    "VALUES ('delete', old.id, old.reply); "
+    "INSERT INTO conversation_reply_fts(rowid, reply) "
+    "VALUES (new.id, new.reply); END",
+]
+
+
+def create_reply_search(connection):
+    """Create the full-text index of replies, if the database has one"""
+    if connection.dialect.name == 'postgresql':
+        statements = _POSTGRESQL_DDL
+    elif connection.dialect.name == 'sqlite':
+        statements = _SQLITE_DDL + [
+            # Index replies which existed before the table
+            "INSERT INTO conversation_reply_fts(conversation_reply_fts) "
+            "VALUES ('rebuild')"]
+    else:
+        return
+
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+event.listen(ConversationReply.__table__, 'after_create',
+             lambda target, connection, **kw: create_reply_search(connection))
+event.listen(ConversationReply.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS conversation_reply_fts')
+             .execute_if(dialect='sqlite'))
+
+
+def _fts5_query(words):
+    # Every word quoted, so user input cannot use the FTS5 query syntax
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def highlight(snippet):
+    """Return `snippet` as HTML, with matched words wrapped in <em>"""
+    return html.escape(snippet)\
+        .replace(HIGHLIGHT_START, '<em>')\
+        .replace(HIGHLIGHT_END, '</em>')
+
+
+def search_replies(words):
+    """Return (query, rank) of replies containing all the `words`.
+
+    The query selects id, conv_id, reply_user_id, reply_time, snippet and
+    rank of matching replies, a higher rank is a better match. `rank` is
+    the expression itself, for ordering and keyset filters. Pass the
+    snippet through highlight() before showing it.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        document = func.to_tsvector(literal_column("'simple'"),
+                                    ConversationReply.reply)
+        search = func.plainto_tsquery(literal_column("'simple'"),
+                                      ' '.join(words))
+
+        # Double precision survives the round trip of a cursor exactly
+        rank = cast(func.ts_rank(document, search), Float)
+        snippet = func.ts_headline(
+            literal_column("'simple'"), ConversationReply.reply, search,
+            'StartSel="{}", StopSel="{}", MaxWords=20, MinWords=10'.format(
+                HIGHLIGHT_START, HIGHLIGHT_END))
+
+        query = db.session.query(ConversationReply)\
+            .filter(document.op('@@')(search))
+    else:
+        fts = table(FTS_TABLE, column('rowid'))
+        fts_name = literal_column(FTS_TABLE)
+
+        # bm25 is lower for better matches
+        rank = -func.bm25(fts_name)
+        snippet = func.snippet(fts_name, 0, HIGHLIGHT_START, HIGHLIGHT_END,
+                               '…', 20)
+
+        query = db.session.query(ConversationReply)\
+            .join(fts, fts.c.rowid == ConversationReply.id)\
+            .filter(fts_name.op('MATCH')(_fts5_query(words)))
+
+    query = query.with_entities(
+        ConversationReply.id, ConversationReply.conv_id,
+        ConversationReply.reply_user_id, ConversationReply.reply_time,
+        snippet.label('snippet'), rank.label('rank'))
+
+    return query, rank
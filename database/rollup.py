@@ -0,0 +1,96 @@
+from sqlalchemy import case, func, literal, select, tuple_, union_all
+from .db import db, upsert_from_select
+from .models import Attendance, AttendanceDaily, User, user_groups
+
+# group_id of the rows counting the whole institution
+INSTITUTION_WIDE = 0
+
+# First key of the advisory locks taken while refreshing an institution
+ROLLUP_LOCK_CLASS = 7001
+
+
+def _lock_institution(institution_id):
+    # Concurrent refreshes of one institution could each count without
+    # the attendance the other one is writing, so on PostgreSQL they wait
+    # for each other. The lock is released at the end of the transaction.
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(select(func.pg_advisory_xact_lock(
+            ROLLUP_LOCK_CLASS, institution_id)))
+
+
+def refresh_attendance_rollup(institution_id=None, dates=None):
+    """Recompute attendance_daily rows from attendance.
+
+    Only the rows of given institution and dates are rebuilt, so calling
+    it after an attendance write costs as much as the attendance of
+    these days. Without arguments the whole table is rebuilt. Counts are
+    written with INSERT ... ON CONFLICT, rows of days (or groups) without
+    attendance any more are deleted. Runs in the current transaction,
+    the caller commits.
+    """
+    rollup = AttendanceDaily.__table__
+
+    if institution_id is not None:
+        _lock_institution(institution_id)
+
+    present_count = func.sum(case((Attendance.present != 0, 1), else_=0))
+    absent_count = func.sum(case((Attendance.present == 0, 1), else_=0))
+    columns = ['institution_id', 'group_id', 'date',
+               'present_count', 'absent_count']
+
+    institution_counts = db.session.query(
+        User.institution_id.label('institution_id'),
+        literal(INSTITUTION_WIDE).label('group_id'),
+        Attendance.date.label('date'), present_count, absent_count)\
+        .join(User, User.id == Attendance.user_id)\
+        .group_by(User.institution_id, Attendance.date)
+
+    group_counts = db.session.query(
+        User.institution_id.label('institution_id'),
+        user_groups.c.group_id.label('group_id'),
+        Attendance.date.label('date'), present_count, absent_count)\
+        .join(User, User.id == Attendance.user_id)\
+        .join(user_groups, user_groups.c.user_id == Attendance.user_id)\
+        .group_by(User.institution_id, user_groups.c.group_id,
+                  Attendance.date)
+
+    keys = []
+    for counts in (institution_counts, group_counts):
+        counts = counts.filter(User.institution_id.isnot(None))
+        if institution_id is not None:
+            counts = counts.filter(User.institution_id == institution_id)
+        if dates is not None:
+            counts = counts.filter(Attendance.date.in_(dates))
+
+        db.session.execute(upsert_from_select(
+            AttendanceDaily, columns, counts.statement,
+            ['institution_id', 'group_id', 'date'],
+            ['present_count', 'absent_count']))
+
+        counted = counts.subquery()
+        keys.append(select(counted.c.institution_id, counted.c.group_id,
+                           counted.c.date))
+
+    delete = rollup.delete().where(
+        tuple_(rollup.c.institution_id, rollup.c.group_id, rollup.c.date)
+        .notin_(union_all(*keys)))
+    if institution_id is not None:
+        delete = delete.where(rollup.c.institution_id == institution_id)
+    if dates is not None:
+        delete = delete.where(rollup.c.date.in_(dates))
+    db.session.execute(delete)
+
+
+def refresh_user_attendance_rollup(user):
+    """Recompute the rollup of the days `user` has attendance on.
+
+    Group counts depend on group membership, call it after groups of the
+    user change. Runs in the current transaction, the caller commits.
+    """
+    if user.institution_id is None:
+        return
+
+    dates = [row.date for row in db.session.query(Attendance.date)
+             .filter(Attendance.user_id == user.id).distinct()]
+    if dates:
+        refresh_attendance_rollup(user.institution_id, dates)
@@ -0,0 +1,85 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from .db import db
+from .models import Conversation, ConversationParticipant, User
+
+# Columns added to tables which existed before them. create_all() only
+# creates missing tables, these have to be added with upgrade_schema().
+NEW_COLUMNS = [
+    # Last reply copy (user-015), user pair (user-023), group title
+    (Conversation, ['title', 'last_reply_id', 'last_reply_at',
+                    'last_reply_user_id', 'last_reply_preview',
+                    'pair_low', 'pair_high']),
+    # Unread counters (user-020) and the inbox order
+    (ConversationParticipant, ['last_read_at', 'unread_count',
+                               'last_reply_at']),
+    # Folded names of user search (user-021)
+    (User, ['search_first_last', 'search_last_first']),
+]
+
+# Unique constraints of new tables, added as unique indexes to old ones
+NEW_UNIQUE_INDEXES = [
+    (Conversation, 'uq_conversation_pair'),
+]
+
+
+def _add_column(connection, column):
+    preparer = connection.dialect.identifier_preparer
+    connection.execute(text('ALTER TABLE {} ADD COLUMN {}'.format(
+        preparer.format_table(column.table),
+        CreateColumn(column).compile(dialect=connection.dialect))))
+
+
+def _add_unique_index(connection, constraint):
+    preparer = connection.dialect.identifier_preparer
+    connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS {} '
+                            'ON {} ({})'.format(
+                                preparer.quote(constraint.name),
+                                preparer.format_table(constraint.table),
+                                ', '.join(preparer.quote(column.name)
+                                          for column in constraint.columns))))
+
+
+def upgrade_schema(connection):
+    """Add the new columns and indexes to tables of an older database.
+
+    Columns and indexes which already exist are left alone, so it is safe
+    to run more than once. Run it before filling the new columns and
+    before the new code serves requests, every query of the models reads
+    these columns. Returns the names of what was added.
+    """
+    inspector = inspect(connection)
+    added = []
+
+    for model, names in NEW_COLUMNS:
+        table = model.__table__
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+
+        for name in names:
+            if name not in existing:
+                _add_column(connection, table.c[name])
+                added.append('{}.{}'.format(table.name, name))
+
+    for model, name in NEW_UNIQUE_INDEXES:
+        table = model.__table__
+        existing = {c['name'] for c in inspector.get_unique_constraints(
+            table.name)}
+        existing |= {i['name'] for i in inspector.get_indexes(table.name)}
+
+        if name not in existing:
+            constraint, = [c for c in table.constraints if c.name == name]
+            _add_unique_index(connection, constraint)
+            added.append(name)
+
+    # Indexes declared on the models, of every table
+    for table in db.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+
+        existing = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                added.append(index.name)
+
+    return added
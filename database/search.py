@@ -0,0 +1,28 @@
+import unicodedata
+
+# Letters that do not decompose into a base letter and an accent
+_FOLD_LETTERS = str.maketrans({'ł': 'l', 'ß': 'ss', 'æ': 'ae', 'ø': 'o',
+                               'đ': 'd', 'ð': 'd', 'þ': 'th'})
+
+
+def fold(text):
+    """Return `text` lower-cased, without diacritics and extra spaces.
+
+    "Łukasz  Żak" becomes "lukasz zak", so searching works no matter how
+    the name was typed.
+    """
+    text = text.lower().translate(_FOLD_LETTERS)
+    text = ''.join(char for char in unicodedata.normalize('NFKD', text)
+                   if not unicodedata.combining(char))
+
+    return ' '.join(text.split())
+
+
+def prefix_range(column, prefix):
+    """Return a condition matching values of `column` starting with `prefix`
+
+    A range instead of LIKE, so a plain index on the column serves it.
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    return (column >= prefix) & (column < upper)
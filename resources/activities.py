@@ -1,6 +1,8 @@
 from flask import Response, request, jsonify, make_response, json
-from database.models import Activity, User, Role, Group
-from .schemas import ActivitySchema
+from database.models import (
+    Activity, ActivityHistory, User, Role, Group, user_roles, user_groups
+)
+from .schemas import ActivitySchema, ActivityHistorySchema
 from database.db import db
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token,
@@ -8,25 +10,35 @@ from flask_jwt_extended import (
 )
 from flask_restful_swagger_2 import Api, swagger, Resource, Schema
 from .swagger_models import Activity as ActivitySwaggerModel
+from .swagger_models import ActivityBatch as ActivityBatchSwaggerModel
 from .swagger_models import GroupActivityLookup
+from .pagination import paginate
+from sqlalchemy import bindparam
+from sqlalchemy.orm import contains_eager
+from datetime import datetime
 
 activity_schema = ActivitySchema()
 activities_schema = ActivitySchema(many=True)
+activity_history_schema = ActivityHistorySchema(many=True)
 
 
 class ActivitiesApi(Resource):
     @swagger.doc({
         'tags': ['activity'],
-        'description': '''Return all the activities. \
-                GET endpoint without any params returns all activities \
-                existing in the application and is not really useful. \
+        'description': '''Return all the activities in an institution \
+                of current user. \
                 \n Parameters: \n \n \
                 \n * *(Optional)* `only_me`: returns an activity for currently \
                 logged in user. Note that it may show nothing if user is an \
                 admin and should only be used for accounts with a role of *Child* \
                 (as they are created automatically for them) \n \
-                \n * *(Optional)* `only_institution`: returns all activities in \
-                an institution for a current user''',
+                \n * *(Optional)* `group_id`: returns activities of users \
+                in given group only \
+                \n * *(Optional)* `page`, `per_page`: paginate the results \
+                (same rules as other paginated endpoints). Without `page` \
+                all activities are returned as a list \
+                \n * *(Optional)* `only_institution`: kept for compatibility, \
+                activities are always limited to the institution''',
         'responses': {
             '200': {
                 'description': 'Successfully got all the activities',
@@ -45,6 +57,21 @@ class ActivitiesApi(Resource):
                 'name': 'only_institution',
                 'in': 'query',
                 'type': 'boolean',
+            },
+            {
+                'name': 'group_id',
+                'in': 'query',
+                'type': 'integer',
+            },
+            {
+                'name': 'page',
+                'in': 'query',
+                'type': 'integer',
+            },
+            {
+                'name': 'per_page',
+                'in': 'query',
+                'type': 'integer',
             }
         ],
         'security': [
@@ -61,22 +88,6 @@ class ActivitiesApi(Resource):
         current_user_institution_id = claims['institution_id']
 
         only_me_query = request.args.get('only_me')
-        only_institution_query = request.args.get('only_institution')
-
-        if only_institution_query == 'true' and only_me_query != 'true':
-            activities = Activity.query.all()
-            act_copy = []
-
-            for activity in activities:
-                user_activity = User.query\
-                    .filter(User.id == activity.user_id)\
-                    .first()
-
-                if user_activity.institution_id == current_user_institution_id:
-                    act_copy.append(activity)
-
-            result = activities_schema.dump(act_copy)
-            return jsonify(result)
 
         if only_me_query == 'true':
             user_activities = Activity.query\
@@ -84,8 +95,22 @@ class ActivitiesApi(Resource):
             result = activity_schema.dump(user_activities)
             return jsonify(result)
 
-        all_activities = Activity.query.all()
-        result = activities_schema.dump(all_activities)
+        activities = Activity.query\
+            .join(User, User.id == Activity.user_id)\
+            .filter(User.institution_id == current_user_institution_id)\
+            .options(contains_eager(Activity.activity_user))\
+            .order_by(Activity.id)
+
+        group_id = request.args.get('group_id')
+        if group_id is not None:
+            activities = activities\
+                .join(user_groups, user_groups.c.user_id == User.id)\
+                .filter(user_groups.c.group_id == int(group_id))
+
+        if request.args.get('page') is not None:
+            return jsonify(paginate(activities, activities_schema))
+
+        result = activities_schema.dump(activities.all())
         return jsonify(result)
 
 
@@ -154,6 +179,146 @@ class ActivityApi(Resource):
         return activity_schema.jsonify(activity)
 
 
+class ActivityBatchApi(Resource):
+    @swagger.doc({
+        'tags': ['activity'],
+        'description': '''Updates activities of many users at once, \
+                e.g. a whole group after lunch. Users that have no \
+                activity or do not belong to the institution of currently \
+                logged in user are skipped. Returns status for each user: \
+                `updated` or `not_found`.''',
+        'parameters': [
+            {
+                'name': 'Body',
+                'in': 'body',
+                'schema': ActivityBatchSwaggerModel,
+                'type': 'object',
+                'required': 'true'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully updated activities',
+            },
+            '401': {
+                'description': 'Unauthorized request',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def put(self):
+        """Update activities of many users"""
+        claims = get_jwt()
+        user_institution_id = claims['institution_id']
+
+        items = {a['user_id']: a for a in request.json['activities']}
+
+        # Users with an activity in current institution, in one query
+        allowed = db.session.query(Activity.user_id)\
+            .join(User, User.id == Activity.user_id)\
+            .filter(Activity.user_id.in_(items.keys()))\
+            .filter(User.institution_id == user_institution_id)\
+            .all()
+        allowed = {a.user_id for a in allowed}
+
+        params = [{'b_user_id': user_id,
+                   'b_sleep': items[user_id]['sleep'],
+                   'b_food_scale': items[user_id]['food_scale']}
+                  for user_id in allowed]
+
+        if params:
+            activity = Activity.__table__
+            db.session.execute(
+                activity.update()
+                .where(activity.c.user_id == bindparam('b_user_id'))
+                .values(sleep=bindparam('b_sleep'),
+                        food_scale=bindparam('b_food_scale')),
+                params)
+            db.session.commit()
+
+        result = [{'user_id': user_id,
+                   'status': 'updated' if user_id in allowed else 'not_found'}
+                  for user_id in items]
+        return jsonify(result)
+
+
+class ActivityHistoryApi(Resource):
+    @swagger.doc({
+        'tags': ['activity'],
+        'description': '''Returns daily activity values of an user, \
+                oldest first. Values of a day are saved every night, \
+                right before activities are cleared. User has to be in \
+                the same institution as currently logged in user. \
+                \n Params: \n \
+                \n * (Required) `id`: User identifier \
+                \n * *(Optional)* `from`: First day of the range \
+                \n * *(Optional)* `to`: Last day of the range''',
+        'parameters': [
+            {
+                'name': 'id',
+                'in': 'path',
+                'type': 'integer'
+            },
+            {
+                'name': 'from',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date'
+            },
+            {
+                'name': 'to',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully got activity history',
+            },
+            '401': {
+                'description': 'Unauthorized request',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def get(self, id):
+        """Return activity history of an user"""
+        claims = get_jwt()
+        user_institution_id = claims['institution_id']
+
+        history = ActivityHistory.query\
+            .join(User, User.id == ActivityHistory.user_id)\
+            .filter(ActivityHistory.user_id == id)\
+            .filter(User.institution_id == user_institution_id)
+
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+
+        if date_from is not None:
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+            history = history.filter(ActivityHistory.date >= date_from)
+
+        if date_to is not None:
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+            history = history.filter(ActivityHistory.date <= date_to)
+
+        history = history.order_by(ActivityHistory.date).all()
+
+        result = activity_history_schema.dump(history)
+        return jsonify(result)
+
+
 class GroupActivitiesApi(Resource):
     @swagger.doc({
         'tags': ['activity'],
@@ -161,13 +326,20 @@ class GroupActivitiesApi(Resource):
                 GET endpoint returns all activities for users with Child \
                 role and group name passed as a parameter. \
                 Params: \n \
-                \n * (Required) `group`: Group name''',
+                \n * (Required) `group`: Group name \
+                \n * *(Optional)* `group_id`: Group identifier, used \
+                instead of `group` when given''',
         'parameters': [
             {
                 'name': 'group',
                 'in': 'query',
                 'type': 'string'
             },
+            {
+                'name': 'group_id',
+                'in': 'query',
+                'type': 'integer'
+            },
         ],
         'responses': {
             '200': {
@@ -190,35 +362,36 @@ class GroupActivitiesApi(Resource):
 
         role_str = "Child"
         group_str = request.args.get('group')
-        activity_list = []
-
-        role = Role.query.filter(Role.title == role_str).first()
-        group = Group.query.filter(Group.name == group_str)\
-            .filter(Group.institution_id == current_user_inst_id).first()
-
-        if not role:
-            return jsonify({'msg': 'Child role doesnt exist'})
-
-        if not group:
-            return jsonify({'msg': 'Group doesnt exist'})
-
-        activities = Activity.query.all()
-        # Get users from user institution
-        users = User.query.filter(
-            User.institution_id == current_user_inst_id).all()
-        # Get users with given role
-        users = list(filter(lambda x: role in x.roles, users))
-        # Get users with given group
-        users = list(filter(lambda x: group in x.groups, users))
-        # Get activities
-        for u in activities:
-            user = list(filter(lambda x: x.id == u.user_id, users))
-            if(user):
-                activity_list.append(u)
+        group_id = request.args.get('group_id')
 
-        result = activities_schema.dump(activity_list)
+        if group_id is not None:
+            group_filter = Group.id == int(group_id)
+        else:
+            group_filter = Group.name == group_str
+
+        # Activities of children in the group, with their users
+        activity_list = Activity.query\
+            .join(User, User.id == Activity.user_id)\
+            .join(user_roles, user_roles.c.user_id == User.id)\
+            .join(Role, Role.id == user_roles.c.role_id)\
+            .join(user_groups, user_groups.c.user_id == User.id)\
+            .join(Group, Group.id == user_groups.c.group_id)\
+            .filter(Role.title == role_str)\
+            .filter(group_filter)\
+            .filter(Group.institution_id == current_user_inst_id)\
+            .filter(User.institution_id == current_user_inst_id)\
+            .options(contains_eager(Activity.activity_user))\
+            .order_by(Activity.id)\
+            .all()
 
         if not activity_list:
+            group = Group.query.filter(group_filter)\
+                .filter(Group.institution_id == current_user_inst_id).first()
+
+            if not group:
+                return jsonify({'msg': 'Group doesnt exist'})
+
             return jsonify({"msg": "No matching activities"})
 
+        result = activities_schema.dump(activity_list)
         return jsonify(result)
@@ -1,19 +1,87 @@
-from flask import Response, request, jsonify, make_response, json
-from database.models import Attendance, User
+from flask import (
+    Response, request, jsonify, make_response, json, stream_with_context
+)
+from database.models import Attendance, User, Group, user_groups
+from database.cache import home_stats_cache
+from database.rollup import refresh_attendance_rollup
 from .schemas import AttendanceSchema
-from database.db import db
+from database.db import db, upsert
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token,
     get_jwt_identity, get_jwt
 )
 from flask_restful_swagger_2 import Api, swagger, Resource, Schema
 from .swagger_models import Attendance as AttendanceSwaggerModel
+from .swagger_models import GroupAttendance as GroupAttendanceSwaggerModel
+from .pagination import paginate
+from .identity import current_identity
+from sqlalchemy import tuple_
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
+import csv
+import io
+
 attendance_schema = AttendanceSchema()
 attendanceM_schema = AttendanceSchema(many=True)
 
 
+def save_attendances(rows, institution_id, overwrite=True):
+    """Write attendance rows with a single INSERT ... ON CONFLICT
+
+    Rows clashing on (user_id, date) replace the stored `present` value
+    when `overwrite` is set and are skipped otherwise. Daily rollups of
+    the written dates are refreshed in the same transaction. Commits and
+    returns the number of rows written.
+    """
+    update_columns = ['present'] if overwrite else None
+    result = db.session.execute(
+        upsert(Attendance, rows, ['user_id', 'date'], update_columns))
+    refresh_attendance_rollup(
+        institution_id, {row['date'] for row in rows})
+    db.session.commit()
+
+    # Bulk statements bypass the ORM events the cache listens to
+    home_stats_cache.invalidate(institution_id)
+
+    return result.rowcount
+
+
+def institution_attendances(institution_id):
+    """Attendances of an institution, joined with their users"""
+    return Attendance.query\
+        .join(User, User.id == Attendance.user_id)\
+        .filter(User.institution_id == institution_id)\
+        .options(contains_eager(Attendance.attendance_user))
+
+
+def filter_attendances(query):
+    """Apply the `from`, `to`, `group_id` and `user_id` query params"""
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    group_id = request.args.get('group_id')
+    user_id = request.args.get('user_id')
+
+    if date_from is not None:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+        query = query.filter(Attendance.date >= date_from)
+
+    if date_to is not None:
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+        query = query.filter(Attendance.date <= date_to)
+
+    if group_id is not None:
+        query = query\
+            .join(user_groups, user_groups.c.user_id == Attendance.user_id)\
+            .filter(user_groups.c.group_id == int(group_id))
+
+    if user_id is not None:
+        query = query.filter(Attendance.user_id == int(user_id))
+
+    return query
+
+
 class AttendanceMApi(Resource):
     @swagger.doc({
         'tags': ['attendance'],
@@ -36,6 +104,19 @@ class AttendanceMApi(Resource):
                 'in': 'query',
                 'type': 'boolean',
                 'description': '*Optional*: Filter by logged in user only'
+            },
+            {
+                'name': 'page',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Which page to return. When set, \
+                the response is paginated'
+            },
+            {
+                'name': 'per_page',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: How many attendances to return per page'
             }
         ],
         'security': [
@@ -51,40 +132,25 @@ class AttendanceMApi(Resource):
         user_institution_id = claims['institution_id']
         current_user_id = claims['id']
 
-        all_attendances = Attendance.query.all()
-
         date_query = request.args.get('date')
         only_me_query = request.args.get('only_me')
 
-        if only_me_query == 'true' and date_query is None:
-            attendances = Attendance.query.filter(
-                Attendance.user_id == current_user_id).all()
-            to_return = attendanceM_schema.dump(attendances)
-            return jsonify(to_return)
+        # Single joined query, users are loaded from the same statement
+        attendances = institution_attendances(user_institution_id)\
+            .order_by(Attendance.date, Attendance.id)
 
         if date_query is not None:
-            # format_date = db.func.date(date_query)
             format_date = datetime.strptime(date_query, '%Y-%m-%d').date()
+            attendances = attendances.filter(Attendance.date == format_date)
 
-            all_attendances = Attendance.query.filter(
-                Attendance.date == format_date).all()
-
-            if only_me_query == 'true':
-                all_attendances = Attendance.query.filter(
-                    Attendance.date == format_date).filter(Attendance.user_id == current_user_id).all()
-
-        attendances_matching = []
+        if only_me_query == 'true':
+            attendances = attendances.filter(
+                Attendance.user_id == current_user_id)
 
-        for attendance in all_attendances:
-            # query user from the attendance
-            att_user = User.query.filter(User.id == attendance.user_id).first()
+        if request.args.get('page') is not None:
+            return jsonify(paginate(attendances, attendanceM_schema))
 
-            print(attendance.date)
-
-            if att_user.institution_id == user_institution_id:
-                attendances_matching.append(attendance)
-
-        result = attendanceM_schema.dump(attendances_matching)
+        result = attendanceM_schema.dump(attendances.all())
         return jsonify(result)
 
     @swagger.doc({
@@ -113,38 +179,258 @@ class AttendanceMApi(Resource):
     @jwt_required()
     def post(self):
         """Add a new attendance"""
-        claims = get_jwt()
-        user_roles = claims['roles']
+        current_user = current_identity()
 
-        # for r in user_roles:
-        #     if(r['title'] != "Teacher" and r['title'] != "Admin"):
+        # for role in current_user.roles:
+        #     if(role != "Teacher" and role != "Admin"):
         #         return jsonify({'msg': 'Insufficient permissions'})
 
-        current_user_id = claims['id']
-
         date_str = request.json['date']
         present = request.json['present']
-        user_id = current_user_id
+        user_id = current_user.id
 
-        user = User.query.get(user_id)
-        if not user:
+        # The token can outlive its user
+        if not current_user.exists():
             return jsonify({'msg': 'User does not exist'})
 
         date = datetime.strptime(date_str, '%Y-%m-%d').date()
 
-        does_exist = Attendance.query.filter(
+        # Duplicates are detected by the (user_id, date) unique index
+        row = {'date': date, 'present': present, 'user_id': user_id}
+        if not save_attendances([row], current_user.institution_id,
+                                overwrite=False):
+            return jsonify({'msg': 'Attendance for this date already exists'})
 
-            Attendance.date == date).filter(Attendance.user_id == current_user_id).first()
+        new_attendance = Attendance.query\
+            .filter(Attendance.user_id == user_id)\
+            .filter(Attendance.date == date).first()
 
-        if does_exist is not None:
-            return jsonify({'msg': 'Attendance for this date already exists'})
+        return attendance_schema.jsonify(new_attendance)
 
-        new_attendance = Attendance(date, present, user_id)
 
-        db.session.add(new_attendance)
-        db.session.commit()
+class AttendanceReportApi(Resource):
+    MAX_PER_PAGE = 500
+    DEFAULT_PER_PAGE = 100
 
-        return attendance_schema.jsonify(new_attendance)
+    @swagger.doc({
+        'tags': ['attendance'],
+        'description': '''Returns attendances in current institution_id \
+                ordered by date, for reports over longer periods. Results \
+                are paginated with a cursor: pass `next_cursor` from the \
+                previous response as `after` to get the next page. \
+                `next_cursor` is null on the last page.''',
+        'responses': {
+            '200': {
+                'description': 'Successfully got the attendances',
+            }
+        },
+        'parameters': [
+            {
+                'name': 'from',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'description': '*Optional*: First day of the range'
+            },
+            {
+                'name': 'to',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'description': '*Optional*: Last day of the range'
+            },
+            {
+                'name': 'group_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Filter by group'
+            },
+            {
+                'name': 'user_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Filter by user'
+            },
+            {
+                'name': 'after',
+                'in': 'query',
+                'type': 'string',
+                'description': '*Optional*: Cursor returned as `next_cursor`'
+            },
+            {
+                'name': 'per_page',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: How many attendances to return \
+                per page (up to 500, 100 by default)'
+            }
+        ],
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def get(self):
+        """Return attendances in a date range"""
+        claims = get_jwt()
+        user_institution_id = claims['institution_id']
+
+        per_page = request.args.get('per_page')
+        if per_page is None:
+            per_page = self.DEFAULT_PER_PAGE
+        per_page = min(max(int(per_page), 1), self.MAX_PER_PAGE)
+
+        attendances = filter_attendances(
+            institution_attendances(user_institution_id))
+
+        # Cursor is "<date>,<id>" of the last attendance already returned
+        after = request.args.get('after')
+        if after:
+            after_date, after_id = after.split(',')
+            after_date = datetime.strptime(after_date, '%Y-%m-%d').date()
+            attendances = attendances.filter(
+                tuple_(Attendance.date, Attendance.id) >
+                tuple_(after_date, int(after_id)))
+
+        # Fetch one more row to know if there is a next page
+        attendances = attendances\
+            .order_by(Attendance.date, Attendance.id)\
+            .limit(per_page + 1).all()
+
+        next_cursor = None
+        if len(attendances) > per_page:
+            attendances = attendances[:per_page]
+            last = attendances[-1]
+            next_cursor = '{},{}'.format(
+                last.date.strftime('%Y-%m-%d'), last.id)
+
+        result = {
+            "per_page": per_page,
+            "next_cursor": next_cursor,
+            "data": attendanceM_schema.dump(attendances)
+        }
+
+        return jsonify(result)
+
+
+class AttendanceExportApi(Resource):
+    EXPORT_COLUMNS = ('id', 'date', 'present', 'user_id', 'email',
+                      'firstname', 'surname')
+
+    @swagger.doc({
+        'tags': ['attendance'],
+        'description': '''Exports attendances in current institution_id \
+                ordered by date. Rows are streamed from the database, so \
+                the export can cover any range. Accepts the same filters \
+                as `/attendance_report`. Only for admins.''',
+        'responses': {
+            '200': {
+                'description': 'Attendances export',
+            }
+        },
+        'parameters': [
+            {
+                'name': 'format',
+                'in': 'query',
+                'type': 'string',
+                'enum': ['csv', 'ndjson'],
+                'description': '*Optional*: `csv` (default) or `ndjson`'
+            },
+            {
+                'name': 'from',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'description': '*Optional*: First day of the range'
+            },
+            {
+                'name': 'to',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'description': '*Optional*: Last day of the range'
+            },
+            {
+                'name': 'group_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Filter by group'
+            },
+            {
+                'name': 'user_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Filter by user'
+            }
+        ],
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def get(self):
+        """Export attendances as CSV or NDJSON"""
+        claims = get_jwt()
+        user_institution_id = claims['institution_id']
+        user_roles = claims['roles']
+
+        for r in user_roles:
+            if(r['title'] != "Admin"):
+                return jsonify({'msg': 'Insufficient permissions'})
+
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return jsonify({'msg': 'Unsupported export format'})
+
+        rows = db.session.query(
+            Attendance.id, Attendance.date, Attendance.present,
+            Attendance.user_id, User.email, User.firstname, User.surname)\
+            .join(User, User.id == Attendance.user_id)\
+            .filter(User.institution_id == user_institution_id)
+        rows = filter_attendances(rows)\
+            .order_by(Attendance.date, Attendance.id)\
+            .execution_options(stream_results=True)\
+            .yield_per(1000)
+
+        if export_format == 'csv':
+            generate = self.generate_csv(rows)
+            mimetype = 'text/csv'
+        else:
+            generate = self.generate_ndjson(rows)
+            mimetype = 'application/x-ndjson'
+
+        filename = 'attendance.{}'.format(export_format)
+        return Response(
+            stream_with_context(generate), mimetype=mimetype,
+            headers={'Content-Disposition':
+                     'attachment; filename={}'.format(filename)})
+
+    def generate_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        writer.writerow(self.EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(
+                (row.id, row.date.strftime('%Y-%m-%d'), row.present,
+                 row.user_id, row.email, row.firstname, row.surname))
+
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        yield buffer.getvalue()
+
+    def generate_ndjson(self, rows):
+        for row in rows:
+            item = dict(zip(self.EXPORT_COLUMNS, row))
+            item['date'] = row.date.strftime('%Y-%m-%d')
+
+            yield json.dumps(item) + '\n'
 
 
 class AttendanceApi(Resource):
@@ -209,11 +495,23 @@ class AttendanceApi(Resource):
 
         date = datetime.strptime(date_str, '%Y-%m-%d').date()
 
+        old_institution_id = attendance.attendance_user.institution_id
+        old_date = attendance.date
+
         attendance.date = date
         attendance.present = present
         attendance.user_id = user_id
 
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'msg': 'Attendance for this date already exists'})
+
+        refresh_attendance_rollup(old_institution_id, [old_date])
+        refresh_attendance_rollup(user.institution_id, [date])
         db.session.commit()
+
         return attendance_schema.jsonify(attendance)
 
     @swagger.doc({
@@ -253,7 +551,80 @@ class AttendanceApi(Resource):
 
         attendance = db.session.query(Attendance).filter(
             Attendance.id == id).first()
+        institution_id = attendance.attendance_user.institution_id
+
         db.session.delete(attendance)
+        db.session.flush()
+
+        refresh_attendance_rollup(institution_id, [attendance.date])
         db.session.commit()
 
         return jsonify({'msg': 'Successfully removed attendance'})
+
+
+class GroupAttendanceApi(Resource):
+    @swagger.doc({
+        'tags': ['attendance'],
+        'description': '''Saves attendance of a whole group for given date \
+                in one request. Every user has to belong to the group and \
+                the group to the institution of currently logged in user. \
+                Attendances already stored for that date are overwritten.''',
+        'parameters': [
+            {
+                'name': 'Body',
+                'in': 'body',
+                'schema': GroupAttendanceSwaggerModel,
+                'type': 'object',
+                'required': 'true'
+            },
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully saved group attendance',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def post(self):
+        """Save attendance for a whole group"""
+        claims = get_jwt()
+        user_institution_id = claims['institution_id']
+        user_roles = claims['roles']
+
+        for r in user_roles:
+            if(r['title'] != "Teacher" and r['title'] != "Admin"):
+                return jsonify({'msg': 'Insufficient permissions'})
+
+        group_id = request.json['group_id']
+        date = datetime.strptime(request.json['date'], '%Y-%m-%d').date()
+        present_by_user = {a['user_id']: a['present']
+                           for a in request.json['attendances']}
+
+        if not present_by_user:
+            return jsonify({'msg': 'No attendances provided'})
+
+        # Check group ownership and membership of every user at once
+        members = db.session.query(user_groups.c.user_id)\
+            .join(Group, Group.id == user_groups.c.group_id)\
+            .filter(Group.id == group_id)\
+            .filter(Group.institution_id == user_institution_id)\
+            .filter(user_groups.c.user_id.in_(present_by_user.keys()))\
+            .all()
+        member_ids = {m.user_id for m in members}
+
+        not_members = sorted(set(present_by_user) - member_ids)
+        if not_members:
+            return jsonify({'msg': 'Users do not belong to given group',
+                            'user_ids': not_members})
+
+        rows = [{'date': date, 'present': present, 'user_id': user_id}
+                for user_id, present in present_by_user.items()]
+        save_attendances(rows, user_institution_id)
+
+        return jsonify({'msg': 'Successfully saved group attendance',
+                        'count': len(rows)})
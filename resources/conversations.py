@@ -1,22 +1,36 @@
-from database.db import pusher_client
-from flask import Response, request, jsonify, make_response, json
-from database.models import Conversation, User, ConversationReply
+from database.push import push_queue
+from database.events import event_hub
+from database.search import fold, prefix_range
+from database.reply_search import highlight, search_replies
+from flask import (
+    Response, request, jsonify, make_response, json, current_app
+)
+from database.models import (
+    Conversation, User, ConversationReply, ConversationParticipant, Group,
+    user_groups
+)
 from .schemas import (
     ConversationSchema, ConversationReplySchema, ConversationLastSchema,
-    UserLookupSchema
+    ConversationReplySearchSchema, UserLookupSchema
 )
-from database.db import db
+from database.db import db, insert_ids, upsert
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token,
-    get_jwt_identity, get_jwt
+    get_jwt_identity, get_jwt, get_jwt_request_location
 )
 from flask_restful_swagger_2 import Api, swagger, Resource, Schema
 from .swagger_models import Conversation as ConversationSwaggerModel
 from .swagger_models import ConversationReply as ConversationReplySwaggerModel
 from .swagger_models import UserLookup as UserLookupSwaggerModel
-from sqlalchemy import and_, or_
+from .swagger_models import GroupBroadcast as GroupBroadcastSwaggerModel
+from sqlalchemy import and_, or_, bindparam, case, func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from .pagination import get_page_args, get_page_bounds
+from .identity import current_identity
+from datetime import datetime, timedelta
 
 import math
+import re
 
 conversation_schema = ConversationSchema()
 conversations_schema = ConversationSchema(many=True)
@@ -24,17 +38,190 @@ conversations_last_schema = ConversationLastSchema(many=True)
 
 conversation_reply_schema = ConversationReplySchema()
 conversations_replies_schema = ConversationReplySchema(many=True)
+replies_search_schema = ConversationReplySearchSchema(many=True)
 
 users_schema = UserLookupSchema(many=True)
 
 
+def inbox_page(user_id, offset, limit):
+    """Return a page of conversations of an user with their last reply.
+
+    The last reply comes from the copy kept on the conversation, so the
+    page is read from conversation_participant and conversation (plus
+    the other participant and the full text of the last reply, both by
+    primary key) in one query and projected into plain dicts shaped for
+    ConversationLastSchema. `preview` is the shortened reply text.
+    Group conversations have no `user_two`.
+    """
+    other_user_id = case(
+        (Conversation.user_two.is_(None), None),
+        (Conversation.user_one == user_id, Conversation.user_two),
+        else_=Conversation.user_one)
+
+    rows = db.session.query(
+        Conversation.id, Conversation.title,
+        Conversation.created_at, Conversation.updated_at,
+        Conversation.last_reply_id, Conversation.last_reply_at,
+        Conversation.last_reply_user_id, Conversation.last_reply_preview,
+        ConversationReply.reply.label('last_reply'),
+        ConversationParticipant.unread_count,
+        User.id.label('user_id'), User.email, User.firstname, User.surname,
+        User.sex, User.active)\
+        .join(ConversationParticipant,
+              ConversationParticipant.conversation_id == Conversation.id)\
+        .outerjoin(User, User.id == other_user_id)\
+        .outerjoin(ConversationReply,
+                   ConversationReply.id == Conversation.last_reply_id)\
+        .filter(ConversationParticipant.user_id == user_id)\
+        .order_by(ConversationParticipant.last_reply_at.desc(),
+                  ConversationParticipant.conversation_id.desc())\
+        .offset(offset).limit(limit)\
+        .all()
+
+    conversations = []
+    for row in rows:
+        last_reply = []
+        if row.last_reply_id is not None:
+            last_reply.append({
+                "id": row.last_reply_id,
+                "reply": row.last_reply,
+                "preview": row.last_reply_preview,
+                "reply_time": row.last_reply_at,
+                "reply_user_id": row.last_reply_user_id
+            })
+
+        user_two = None
+        if row.user_id is not None:
+            user_two = {
+                "id": row.user_id,
+                "email": row.email,
+                "firstname": row.firstname,
+                "surname": row.surname,
+                "sex": row.sex,
+                "active": row.active
+            }
+
+        conversations.append({
+            "id": row.id,
+            "title": row.title,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "unread_count": row.unread_count,
+            "user_two_obj": user_two,
+            "conversation_replies": last_reply
+        })
+
+    return conversations
+
+
+_UTC_OFFSET = re.compile(r'(?:Z|([+-])(\d{2}):?(\d{2}))$', re.IGNORECASE)
+
+
+def parse_utc_datetime(value):
+    """Parse an ISO 8601 time into a naive UTC datetime like reply_time.
+
+    Accepts a `Z` suffix or a +HH:MM offset, which fromisoformat() of
+    Python 3.7 does not handle the same way. A time without an offset is
+    taken as UTC. Raises ValueError for anything else.
+    """
+    offset = _UTC_OFFSET.search(value)
+    if offset is None:
+        return datetime.fromisoformat(value)
+
+    result = datetime.fromisoformat(value[:offset.start()])
+    sign, hours, minutes = offset.groups()
+    if sign is not None:
+        delta = timedelta(hours=int(hours), minutes=int(minutes))
+        result = result - delta if sign == '+' else result + delta
+
+    return result
+
+
+def total_unread(user_id):
+    """Return the number of unread replies in all conversations of an user
+
+    Sums the counters of the user's participant rows, the replies
+    themselves are not read.
+    """
+    return db.session.query(
+        func.coalesce(func.sum(ConversationParticipant.unread_count), 0))\
+        .filter(ConversationParticipant.user_id == user_id)\
+        .scalar()
+
+
+def record_replies(replies, sender_id):
+    """Update conversations and participants after `replies` were flushed
+
+    Keeps the last reply copy of every conversation (unless a newer reply
+    got there first) and the unread counters in the same transaction as
+    the replies: the sender has read the conversation, everybody else
+    gets one more unread reply. Participants get the new last_reply_at
+    of their conversation, the inbox is ordered by it.
+    """
+    conversation = Conversation.__table__
+    db.session.execute(
+        conversation.update()
+        .where(conversation.c.id == bindparam('b_conv_id'))
+        .where(or_(conversation.c.last_reply_id.is_(None),
+                   conversation.c.last_reply_id < bindparam('b_reply_id')))
+        .values(
+            updated_at=db.func.current_timestamp(),
+            last_reply_id=bindparam('b_reply_id'),
+            last_reply_at=select(ConversationReply.reply_time)
+            .where(ConversationReply.id == bindparam('b_reply_id'))
+            .scalar_subquery(),
+            last_reply_user_id=sender_id,
+            last_reply_preview=bindparam('b_preview')),
+        [{'b_conv_id': r.conv_id, 'b_reply_id': r.id,
+          'b_preview': r.reply[:Conversation.PREVIEW_LENGTH]}
+         for r in replies])
+
+    is_sender = ConversationParticipant.user_id == sender_id
+    ConversationParticipant.query\
+        .filter(ConversationParticipant.conversation_id.in_(
+            {r.conv_id for r in replies}))\
+        .update({
+            'unread_count': case(
+                (is_sender, 0),
+                else_=ConversationParticipant.unread_count + 1),
+            'last_read_at': case(
+                (is_sender, db.func.current_timestamp()),
+                else_=ConversationParticipant.last_read_at),
+            'last_reply_at': select(Conversation.last_reply_at)
+            .where(Conversation.id == ConversationParticipant.conversation_id)
+            .scalar_subquery()
+        }, synchronize_session=False)
+
+
+def find_pair_conversation(user_one, user_two):
+    """Return the conversation of two users, using the unique pair index"""
+    pair_low, pair_high = sorted((user_one, user_two))
+
+    return Conversation.query\
+        .filter_by(pair_low=pair_low, pair_high=pair_high)\
+        .first()
+
+
+def conversation_exists(conversation):
+    return jsonify({
+        'msg': 'Conversation already exists',
+        'conversation': conversation_schema.dump(conversation)
+    })
+
+
+def is_participant(conv_id, user_id):
+    """Check membership with a primary key lookup"""
+    return ConversationParticipant.query.get((conv_id, user_id)) is not None
+
+
 class ConversationsApi(Resource):
     @swagger.doc({
         'tags': ['conversation'],
         'description': 'Returns ALL the conversations for logged user',
         'responses': {
             '200': {
-                'description': 'Successfully got all the conversations for logged user',
+                'description': 'Successfully got all the conversations for logged user. \
+                    `last_reply` has the full `reply` and its first 100 characters in `preview`',
             }
         },
         'parameters': [
@@ -60,84 +247,28 @@ class ConversationsApi(Resource):
     @jwt_required()
     def get(self):
         """Return ALL the conversations for logged user"""
+        current_user = current_identity()
 
-        # TODO: Use get_jwt() instead (needed for unittesting)
-        claims_jwt = get_jwt()
-        jwt_email = claims_jwt['email']
-
-        current_user = User.query.filter_by(email=jwt_email).first()
-
-        total_conversations = Conversation.query.filter(
-            or_(Conversation.user_one == current_user.id,
-                Conversation.user_two == current_user.id)).count()
-
-        MIN_PER_PAGE = 5
-        MAX_PER_PAGE = 30
-
-        # Get query parameters
-        page = request.args.get('page')
-        per_page = request.args.get('per_page')
-
-        # If page is not provided, set to first page by default
-        if page is None or int(page) < 1:
-            page = 1
-
-        # Default pagination
-        if per_page is None:
-            per_page = 15
-
-        if int(per_page) < MIN_PER_PAGE:
-            per_page = MIN_PER_PAGE
-
-        if int(per_page) > MAX_PER_PAGE:
-            per_page = MAX_PER_PAGE
-
-        last_page = math.ceil(int(total_conversations) / int(per_page))
-
-        if int(page) >= last_page:
-            page = int(last_page)
-
-        page_offset = (int(page) - 1) * int(per_page)
-
-        conversations_query = Conversation.query.filter(
-            or_(Conversation.user_one == current_user.id,
-                Conversation.user_two == current_user.id)).order_by(Conversation.updated_at.desc()).offset(page_offset).limit(per_page).all()
-
-        # Copying query to separate list, so we won't delete actual records
-        conversations_copy = []
-        for convo in conversations_query:
-            conversations_copy.append(convo)
-
-            if convo.user_two == current_user.id:
-                convo.user_two = convo.user_one
-
-        # For each conversation we clear all the replies and leave out
-        # only the last one
-        for convo in conversations_copy:
-            last_reply = ConversationReply.query.filter_by(
-                conv_id=convo.id).order_by(ConversationReply.reply_time.desc()).first()
-            convo.conversation_replies.clear()
-
-            # Don't insert None into the list
-            if last_reply is not None:
-                convo.conversation_replies.append(last_reply)
+        total_conversations = ConversationParticipant.query.filter(
+            ConversationParticipant.user_id == current_user.id).count()
 
-        conversations_query_result = conversations_last_schema.dump(
-            conversations_copy)
+        page, per_page, last_page, page_offset = get_page_bounds(
+            total_conversations)
 
         result = {
             "total": total_conversations,
-            "per_page": int(per_page),
-            "current_page": int(page),
+            "per_page": per_page,
+            "current_page": page,
             "last_page": last_page,
-            "data": conversations_query_result
+            "data": conversations_last_schema.dump(
+                inbox_page(current_user.id, page_offset, per_page))
         }
 
         return jsonify(result)
 
     @swagger.doc({
         'tags': ['conversation'],
-        'description': 'Adds a new conversation for current user',
+        'description': 'Adds a new conversation for current user. Pass `user_two` for a conversation of two users or `participants` (and optional `title`) for a group conversation. If the two users already have a conversation, it is returned in `conversation` together with a message',
         'parameters': [
             {
                 'name': 'Body',
@@ -161,34 +292,67 @@ class ConversationsApi(Resource):
     @jwt_required()
     def post(self):
         """Add a new conversation for current user"""
-        claims_jwt = get_jwt()
-        jwt_email = claims_jwt['email']
-        current_user = User.query.filter_by(email=jwt_email).first()
-
-        user_one = current_user.id
-        user_two = request.json['user_two']
+        user_one = current_identity().id
         created_at = db.func.current_timestamp()
         updated_at = db.func.current_timestamp()
 
-        does_exist = Conversation.query.filter(
-            or_(
-                and_(Conversation.user_one == user_one,
-                     Conversation.user_two == user_two),
-                and_(Conversation.user_one == user_two,
-                     Conversation.user_two == user_one))).first()
-        if does_exist is not None:
-            return jsonify({'msg': 'Conversation already exists'})
+        participants = request.json.get('participants')
+        if participants is not None:
+            return self.post_group(user_one, participants, created_at,
+                                   updated_at)
+
+        user_two = request.json['user_two']
+
+        if user_one == user_two:
+            return jsonify({'msg': 'Could not make conversation with the same user'})
+
+        existing = find_pair_conversation(user_one, user_two)
+        if existing is not None:
+            return conversation_exists(existing)
 
         user_two_exists = User.query.filter_by(id=user_two).first()
 
         if not user_two_exists:
             return jsonify({'msg': 'User with given id does not exist'})
 
-        if user_one == user_two:
+        new_conversation = Conversation(
+            user_one, user_two, created_at, updated_at)
+        new_conversation.participants = [
+            ConversationParticipant(None, user_one, created_at),
+            ConversationParticipant(None, user_two, created_at)]
+
+        db.session.add(new_conversation)
+
+        # The unique pair index stops a concurrent request creating the
+        # same conversation, return the one which got there first
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return conversation_exists(
+                find_pair_conversation(user_one, user_two))
+
+        return conversation_schema.jsonify(new_conversation)
+
+    def post_group(self, user_one, participants, created_at, updated_at):
+        """Add a new conversation with many participants"""
+        participants = set(participants)
+        participants.discard(user_one)
+
+        if not participants:
             return jsonify({'msg': 'Could not make conversation with the same user'})
 
+        # Check all the users at once
+        existing = User.query.filter(User.id.in_(participants)).count()
+        if existing != len(participants):
+            return jsonify({'msg': 'User with given id does not exist'})
+
         new_conversation = Conversation(
-            user_one, user_two, created_at, updated_at)
+            user_one, None, created_at, updated_at)
+        new_conversation.title = request.json.get('title')
+        new_conversation.participants = [
+            ConversationParticipant(None, user_id, created_at)
+            for user_id in sorted(participants | {user_one})]
 
         db.session.add(new_conversation)
         db.session.commit()
@@ -223,22 +387,16 @@ class ConversationReplyApi(Resource):
     @jwt_required()
     def post(self):
         """Add a new conversation reply"""
-        claims_jwt = get_jwt()
-        jwt_email = claims_jwt['email']
-        jwt_id = claims_jwt['id']
-        current_user = User.query.filter_by(email=jwt_email).first()
-
         reply = request.json['reply']
-        reply_user_id = current_user.id
+        reply_user_id = current_identity().id
         conv_id = request.json['conv_id']
 
-        # Check if conversation exists
-        conv_exists = Conversation.query.filter_by(id=conv_id).first()
-        if conv_exists is None:
-            return jsonify({'msg': 'Conversation does not exist'})
-
         # Check if given user exist in conversation
-        if not (conv_exists.user_one == reply_user_id or conv_exists.user_two == reply_user_id):
+        if not is_participant(conv_id, reply_user_id):
+            conv_exists = Conversation.query.get(conv_id)
+            if conv_exists is None:
+                return jsonify({'msg': 'Conversation does not exist'})
+
             return jsonify({'msg': 'No such user in given conversation'})
 
         reply_time = db.func.current_timestamp()
@@ -246,27 +404,139 @@ class ConversationReplyApi(Resource):
         new_conv_reply = ConversationReply(
             reply, reply_time, reply_user_id, conv_id)
 
-        # Update conversation
-        conv_exists.updated_at = db.func.current_timestamp()
-
         db.session.add(new_conv_reply)
+        db.session.flush()
+
+        record_replies([new_conv_reply], reply_user_id)
         db.session.commit()
 
         push_message = conversation_reply_schema.dump(new_conv_reply)
 
-        if conv_exists.user_two == jwt_id:
-            user_two_channel = conv_exists.user_one
-        else:
-            user_two_channel = conv_exists.user_two
+        # Every other participant listens on a channel named by their id
+        recipients = db.session.query(ConversationParticipant.user_id)\
+            .filter(ConversationParticipant.conversation_id == conv_id)\
+            .filter(ConversationParticipant.user_id != reply_user_id)\
+            .all()
+        channels = [str(r.user_id) for r in recipients]
 
-        usr_two_unic = str(user_two_channel)
-
-        pusher_client.trigger(usr_two_unic, u'my-event',
-                              push_message)
+        push_queue.publish(channels, u'my-event', push_message)
+        event_hub.publish(channels, u'my-event', push_message)
 
         return conversation_reply_schema.jsonify(new_conv_reply)
 
 
+class GroupBroadcastApi(Resource):
+    @swagger.doc({
+        'tags': ['conversation_reply'],
+        'description': 'Sends the same reply to every member of a group, \
+            each in the two person conversation with logged user. Missing \
+            conversations are created',
+        'parameters': [
+            {
+                'name': 'Body',
+                'in': 'body',
+                'schema': GroupBroadcastSwaggerModel,
+                'type': 'object',
+                'required': 'true'
+            },
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully sent reply to the group',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def post(self):
+        """Send a reply to every member of a group"""
+        current_user = current_identity()
+        sender_id = current_user.id
+        user_institution_id = current_user.institution_id
+
+        for role in current_user.roles:
+            if(role != "Teacher" and role != "Admin"):
+                return jsonify({'msg': 'Insufficient permissions'})
+
+        group_id = request.json['group_id']
+        reply = request.json['reply']
+
+        members = db.session.query(user_groups.c.user_id)\
+            .join(Group, Group.id == user_groups.c.group_id)\
+            .filter(Group.id == group_id)\
+            .filter(Group.institution_id == user_institution_id)\
+            .filter(user_groups.c.user_id != sender_id)\
+            .all()
+        recipients = sorted(m.user_id for m in members)
+
+        if not recipients:
+            group = Group.query.filter_by(
+                id=group_id, institution_id=user_institution_id).first()
+            if group is None:
+                return jsonify({'msg': 'Group doesnt exist'})
+
+            return jsonify({'msg': 'No users in given group'})
+
+        now = db.session.query(db.func.current_timestamp()).scalar()
+
+        # Create missing conversations, those which exist (maybe created
+        # by a concurrent request) are left alone
+        db.session.execute(upsert(Conversation, [
+            {'user_one': sender_id, 'user_two': user_id,
+             'pair_low': min(sender_id, user_id),
+             'pair_high': max(sender_id, user_id),
+             'created_at': now, 'updated_at': now, 'last_reply_at': now}
+            for user_id in recipients], ['pair_low', 'pair_high']))
+
+        conversations = db.session.query(
+            Conversation.id, Conversation.pair_low, Conversation.pair_high)\
+            .filter(or_(
+                and_(Conversation.pair_low == sender_id,
+                     Conversation.pair_high.in_(recipients)),
+                and_(Conversation.pair_high == sender_id,
+                     Conversation.pair_low.in_(recipients))))\
+            .all()
+        conversation_by_user = {
+            c.pair_high if c.pair_low == sender_id else c.pair_low: c.id
+            for c in conversations}
+
+        db.session.execute(upsert(ConversationParticipant, [
+            {'conversation_id': conv_id, 'user_id': user_id,
+             'unread_count': 0, 'last_reply_at': now}
+            for recipient, conv_id in conversation_by_user.items()
+            for user_id in (sender_id, recipient)],
+            ['conversation_id', 'user_id']))
+
+        # All the replies in one INSERT. They stay out of the session,
+        # so the push messages are built without loading them back
+        replies = [ConversationReply(reply, now, sender_id,
+                                     conversation_by_user[user_id])
+                   for user_id in recipients]
+        reply_ids = insert_ids(ConversationReply, [
+            {'reply': r.reply, 'reply_time': r.reply_time,
+             'reply_user_id': r.reply_user_id, 'conv_id': r.conv_id}
+            for r in replies])
+        for new_reply, reply_id in zip(replies, reply_ids):
+            new_reply.id = reply_id
+
+        record_replies(replies, sender_id)
+        push_messages = conversation_reply_schema.dump(replies, many=True)
+        db.session.commit()
+
+        # Every recipient listens on a channel named by their id, the
+        # push queue sends the events in batches
+        for user_id, push_message in zip(recipients, push_messages):
+            push_queue.publish(str(user_id), u'my-event', push_message)
+            event_hub.publish(str(user_id), u'my-event', push_message)
+
+        return jsonify({'msg': 'Successfully sent reply to the group',
+                        'count': len(replies)})
+
+
 class ConversationRepliesApi(Resource):
     @swagger.doc({
         'tags': ['conversation_reply'],
@@ -290,10 +560,37 @@ class ConversationRepliesApi(Resource):
                 'type': 'integer',
                 'description': '*Optional*: How many replies to return per page'
             },
+            {
+                'name': 'before_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Return replies older than reply with this id, newest first'
+            },
+            {
+                'name': 'after_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Return replies newer than reply with this id, oldest first'
+            },
+            {
+                'name': 'since',
+                'in': 'query',
+                'type': 'string',
+                'description': '*Optional*: Return replies sent after given time (ISO 8601, UTC unless it has `Z` or an offset), oldest first. \
+                    Times have one second resolution, to continue from a reply pass its id in `since_id` (or use `after_id`)'
+            },
+            {
+                'name': 'since_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: With `since`, also return replies sent in the same time with a bigger id'
+            },
         ],
         'responses': {
             '200': {
-                'description': 'Successfully got all the replies in conversation',
+                'description': 'Successfully got all the replies in conversation. \
+                    With `before_id`, `after_id` or `since` the result is \
+                    {per_page, has_more, data} without a total count',
             }
         },
         'security': [
@@ -305,6 +602,12 @@ class ConversationRepliesApi(Resource):
     @jwt_required()
     def get(self, conv_id):
         """Return ALL the replies in given conversation"""
+        if not is_participant(conv_id, current_identity().id):
+            return jsonify({'msg': 'Conversation does not exist'})
+
+        if any(request.args.get(arg) for arg in
+               ('before_id', 'after_id', 'since')):
+            return self.get_cursor_page(conv_id)
 
         total_replies = ConversationReply.query.filter(
             ConversationReply.conv_id == conv_id).count()
@@ -337,10 +640,6 @@ class ConversationRepliesApi(Resource):
 
         page_offset = (int(page) - 1) * int(per_page)
 
-        conversation = Conversation.query.filter_by(id=conv_id).first()
-        if conversation is None:
-            return jsonify({'msg': 'Conversation does not exist'})
-
         replies_query = ConversationReply.query.filter_by(
             conv_id=conv_id).order_by(ConversationReply.reply_time.desc()).offset(page_offset).limit(per_page).all()
 
@@ -356,11 +655,350 @@ class ConversationRepliesApi(Resource):
 
         return jsonify(result)
 
+    def get_cursor_page(self, conv_id):
+        """Return one page of replies next to a cursor.
+
+        Replies are ordered by (reply_time, id), which is served by an
+        index together with conv_id, so no COUNT or OFFSET is needed.
+        """
+        _, per_page = get_page_args()
+
+        replies = ConversationReply.query.filter(
+            ConversationReply.conv_id == conv_id)
+        position = tuple_(ConversationReply.reply_time, ConversationReply.id)
+
+        before_id = request.args.get('before_id')
+        after_id = request.args.get('after_id')
+        since = request.args.get('since')
+
+        if before_id or after_id:
+            cursor = ConversationReply.query\
+                .filter_by(id=int(before_id or after_id), conv_id=conv_id)\
+                .first()
+            if cursor is None:
+                return jsonify({'msg': 'Reply does not exist'})
+
+            cursor_position = tuple_(cursor.reply_time, cursor.id)
+
+        if before_id:
+            # Scrolling back, newest first like the other pages
+            replies = replies.filter(position < cursor_position)\
+                .order_by(ConversationReply.reply_time.desc(),
+                          ConversationReply.id.desc())
+        else:
+            if after_id:
+                replies = replies.filter(position > cursor_position)
+            else:
+                try:
+                    since = parse_utc_datetime(since)
+                except ValueError:
+                    return jsonify({'msg': 'Wrong date format'})
+
+                # Replies of the same second are told apart by their id
+                since_id = request.args.get('since_id')
+                if since_id:
+                    replies = replies.filter(
+                        position > tuple_(since, int(since_id)))
+                else:
+                    replies = replies.filter(
+                        ConversationReply.reply_time > since)
+
+            # Polling for new replies, oldest first
+            replies = replies.order_by(ConversationReply.reply_time,
+                                       ConversationReply.id)
+
+        # Fetch one more row to know if there are more replies
+        replies = replies.limit(per_page + 1).all()
+
+        result = {
+            "per_page": per_page,
+            "has_more": len(replies) > per_page,
+            "data": conversations_replies_schema.dump(replies[:per_page])
+        }
+
+        return jsonify(result)
+
+
+class ConversationSearchApi(Resource):
+    DEFAULT_PER_PAGE = 20
+    MAX_PER_PAGE = 100
+
+    @swagger.doc({
+        'tags': ['conversation_reply'],
+        'description': 'Full-text search of replies in conversations of \
+            logged user. Best matches first, each with a snippet where \
+            matched words are wrapped in `<em>`, the rest of the snippet is \
+            HTML escaped',
+        'parameters': [
+            {
+                'name': 'q',
+                'in': 'query',
+                'type': 'string',
+                'required': 'true',
+                'description': 'Words which all have to be in the reply'
+            },
+            {
+                'name': 'conv_id',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: Search only given conversation'
+            },
+            {
+                'name': 'per_page',
+                'in': 'query',
+                'type': 'integer',
+                'description': '*Optional*: How many replies to return, 20 by default, at most 100'
+            },
+            {
+                'name': 'after',
+                'in': 'query',
+                'type': 'string',
+                'description': '*Optional*: `next_cursor` of the previous page'
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully searched replies',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def get(self):
+        """Search replies of the current user's conversations"""
+        current_user = current_identity()
+
+        words = request.args.get('q', '').split()
+        if not words:
+            return jsonify({'msg': 'Nothing to search for'})
+
+        per_page = request.args.get('per_page')
+        if per_page is None:
+            per_page = self.DEFAULT_PER_PAGE
+        per_page = min(max(int(per_page), 1), self.MAX_PER_PAGE)
+
+        replies, rank = search_replies(words)
+        replies = replies\
+            .join(ConversationParticipant,
+                  ConversationParticipant.conversation_id ==
+                  ConversationReply.conv_id)\
+            .filter(ConversationParticipant.user_id == current_user.id)
+
+        conv_id = request.args.get('conv_id')
+        if conv_id:
+            replies = replies.filter(ConversationReply.conv_id == int(conv_id))
+
+        # Cursor is "<rank>,<id>" of the last reply already returned
+        after = request.args.get('after')
+        if after:
+            after_rank, after_id = after.rsplit(',', 1)
+            replies = replies.filter(
+                tuple_(rank, ConversationReply.id) <
+                tuple_(float(after_rank), int(after_id)))
+
+        # Fetch one more row to know if there is a next page
+        replies = replies\
+            .order_by(rank.desc(), ConversationReply.id.desc())\
+            .limit(per_page + 1).all()
+
+        next_cursor = None
+        if len(replies) > per_page:
+            replies = replies[:per_page]
+            last = replies[-1]
+            next_cursor = '{!r},{}'.format(last.rank, last.id)
+
+        result = {
+            "per_page": per_page,
+            "next_cursor": next_cursor,
+            "data": replies_search_schema.dump([
+                dict(r._mapping, snippet=highlight(r.snippet))
+                for r in replies])
+        }
+
+        return jsonify(result)
+
+
+class ConversationReadApi(Resource):
+    @swagger.doc({
+        'tags': ['conversation'],
+        'description': 'Marks all the replies in conversation as read by \
+            logged user',
+        'parameters': [
+            {
+                'name': 'conv_id',
+                'in': 'path',
+                'type': 'integer',
+                'required': 'true'
+            },
+        ],
+        'responses': {
+            '200': {
+                'description': 'Successfully marked conversation as read',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def put(self, conv_id):
+        """Mark conversation as read"""
+        marked = ConversationParticipant.query\
+            .filter(ConversationParticipant.conversation_id == conv_id)\
+            .filter(ConversationParticipant.user_id == current_identity().id)\
+            .update({
+                'unread_count': 0,
+                'last_read_at': db.func.current_timestamp()
+            }, synchronize_session=False)
+        db.session.commit()
+
+        if not marked:
+            return jsonify({'msg': 'Conversation does not exist'})
+
+        return jsonify({'msg': 'Successfully marked conversation as read'})
+
+
+# Claims set by flask_jwt_extended, not copied into stream tokens
+_TOKEN_CLAIMS = ('exp', 'iat', 'nbf', 'jti', 'sub', 'type', 'fresh', 'csrf')
+
+
+class EventStreamTokenApi(Resource):
+    @swagger.doc({
+        'tags': ['conversation'],
+        'description': 'Returns a short-lived token for `/events`. \
+            EventSource cannot set headers, so the token goes into the \
+            query string and ends up in access logs, it is only accepted \
+            there for EVENT_STREAM_TOKEN_TTL seconds',
+        'responses': {
+            '200': {
+                'description': 'Token to pass as `jwt` to `/events`',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def post(self):
+        """Return a token opening the event stream"""
+        claims = {key: value for key, value in get_jwt().items()
+                  if key not in _TOKEN_CLAIMS}
+        claims['events_only'] = True
+
+        token = create_access_token(
+            identity=get_jwt_identity(), additional_claims=claims,
+            expires_delta=timedelta(
+                seconds=current_app.config.get('EVENT_STREAM_TOKEN_TTL', 60)))
+
+        return jsonify({'token': token})
+
+
+class EventStreamApi(Resource):
+    @swagger.doc({
+        'tags': ['conversation'],
+        'description': 'Stream of realtime events (new replies) of logged \
+            user as Server-Sent Events. The same events as on the Pusher \
+            channel of the user. Browsers pass a token from \
+            `/events_token` in `jwt` query parameter, EventSource cannot \
+            set headers, other tokens are only accepted in the header. A server \
+            process keeps at most EVENT_STREAM_MAX_CONNECTIONS streams \
+            open, then clients should fall back to Pusher',
+        'parameters': [
+            {
+                'name': 'jwt',
+                'in': 'query',
+                'type': 'string',
+                'description': '*Optional*: Token from `/events_token`, instead of the header'
+            },
+        ],
+        'responses': {
+            '200': {
+                'description': 'text/event-stream with `my-event` events, \
+                    or `msg` when there are too many open streams',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required(locations=['headers', 'query_string'])
+    def get(self):
+        """Stream events of the current user"""
+        keepalive = current_app.config.get('EVENT_STREAM_KEEPALIVE', 15)
+
+        # Query strings end up in access logs, only short-lived tokens
+        if get_jwt_request_location() == 'query_string' and \
+                not get_jwt().get('events_only'):
+            return jsonify({'msg': 'Use a token from /events_token'})
+
+        # Subscribe before the response starts, not to miss any event
+        subscription = event_hub.subscribe(str(current_identity().id))
+        if subscription is None:
+            return jsonify({'msg': 'Too many open event streams'})
+
+        def stream():
+            yield ': connected\n\n'
+
+            while True:
+                event = subscription.get(keepalive)
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+
+                yield 'event: {}\ndata: {}\n\n'.format(
+                    event['name'], json.dumps(event['data']))
+
+        response = Response(stream(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        # Also frees the place of a client gone before the first event
+        response.call_on_close(lambda: event_hub.unsubscribe(subscription))
+        return response
+
+
+class PushQueueStatsApi(Resource):
+    @swagger.doc({
+        'tags': ['conversation'],
+        'description': 'Returns the state of the outgoing push queue',
+        'responses': {
+            '200': {
+                'description': 'Queue depth and counters of sent, retried, \
+                    failed and dropped events',
+            }
+        },
+        'security': [
+            {
+                'api_key': []
+            }
+        ]
+    })
+    @jwt_required()
+    def get(self):
+        """Return push queue metrics"""
+        for role in current_identity().roles:
+            if(role != "Admin"):
+                return jsonify({'msg': 'Insufficient permissions'})
+
+        return jsonify(push_queue.stats())
+
 
 class UserSearchApi(Resource):
     @swagger.doc({
         'tags': ['conversation'],
-        'description': 'Looks for users matching',
+        'description': 'Looks for users of current institution whose \
+            "firstname surname" or "surname firstname" starts with \
+            `name_like`, ignoring case and diacritics',
         'parameters': [
             {
                 'name': 'Body',
@@ -386,22 +1024,21 @@ class UserSearchApi(Resource):
         """Search user by his firstname and surname"""
 
         # Get currently logged user's InstitutionId
-        claims = get_jwt()
-        current_user_inst_id = claims['institution_id']
-
-        name_like = request.json['name_like']
-        user_list = []
+        current_user_inst_id = current_identity().institution_id
 
-        search_result = db.session.query(User).filter(User.institution_id == current_user_inst_id).filter(
-            (User.firstname + ' ' + User.surname).like('{0}%'.format(name_like))).limit(10).all()
+        name_like = fold(request.json['name_like'])
 
-        for u in search_result:
-            # We query user by u.id
-            user_query = User.query.filter(
-                User.id == u.id).filter(User.institution_id == current_user_inst_id).first()
+        # Matches "firstname surname" as well as "surname firstname"
+        search_query = User.query.filter(
+            User.institution_id == current_user_inst_id)
+        if name_like:
+            search_query = search_query.filter(or_(
+                prefix_range(User.search_first_last, name_like),
+                prefix_range(User.search_last_first, name_like)))
 
-            # Append it to the list of users
-            user_list.append(user_query)
+        user_list = search_query\
+            .order_by(User.search_first_last, User.id)\
+            .limit(10).all()
 
         result = users_schema.dump(user_list)
 
@@ -2,6 +2,7 @@ from flask import Response, request, jsonify, make_response, json
 from database.models import Group, User, user_groups
 from .schemas import GroupSchema, UserGetSchema
 from database.db import db
+from database.rollup import refresh_user_attendance_rollup
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token,
     get_jwt_identity, get_jwt
@@ -351,6 +352,8 @@ class UserGroupApi(Resource):
             return jsonify({'msg': 'User already has this group'})
 
         user.groups.append(group)
+        db.session.flush()
+        refresh_user_attendance_rollup(user)
         db.session.commit()
 
         return jsonify({'msg': 'Successfully added group to the user'})
@@ -400,6 +403,8 @@ class UserGroupApi(Resource):
 
         if(group in user.groups):
             result = user.groups.remove(group)
+            db.session.flush()
+            refresh_user_attendance_rollup(user)
             db.session.commit()
             return jsonify({'msg': 'Group removed'})
         else:
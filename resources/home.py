@@ -1,9 +1,12 @@
 from flask import Response, request, jsonify, make_response, json
 from database.models import (
-    User, Activity, Role, Attendance, Image, News
+    User, Activity, Role, Attendance, AttendanceDaily, Image, News
 )
+from database.rollup import INSTITUTION_WIDE
+from .conversations import total_unread
 from .schemas import UserGetSchema, UserTokenSchema, UserHomeSchema, NewsSchema
 from database.db import db
+from database.cache import home_stats_cache
 from flask_jwt_extended import (
     JWTManager, jwt_required, create_access_token,
     get_jwt_identity, current_user, create_refresh_token, get_jwt
@@ -12,8 +15,8 @@ from flask_restful_swagger_2 import Api, swagger, Resource, Schema
 from .swagger_models import User as UserSwaggerModel
 from flask_sqlalchemy import SQLAlchemy
 from .security import generate_salt, generate_hash
-from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from datetime import date, timedelta
+from sqlalchemy import and_, or_, case, distinct, func
 
 import math
 
@@ -35,7 +38,9 @@ class HomeStatsApi(Resource):
                 \n * `absence`: Returns the count of absent users in the \
                 last seven days \
                 \n * `news`: Returns last 5 news in current institution. Sorted \
-                by *created_at* descending''',
+                by *created_at* descending \
+                \n * `unread`: How many unread replies logged user has in \
+                all conversations''',
         'responses': {
             '200': {
                 'description': 'Successfully got all the users',
@@ -54,75 +59,77 @@ class HomeStatsApi(Resource):
     def get(self):
         """Return home stats"""
         claims = get_jwt()
-        current_user_id = claims['id']
         user_institution_id = claims['institution_id']
 
-        teacher_role = Role.query.filter(Role.title == "Teacher").first()
-        child_role = Role.query.filter(Role.title == "Child").first()
-
-        num_of_teachers = User.query\
-            .filter(User.roles.any(id=teacher_role.id))\
-            .filter(User.active == 1)\
-            .filter(User.institution_id == user_institution_id)\
-            .count()
-
-        num_of_children = User.query\
-            .filter(User.roles.any(id=child_role.id))\
-            .filter(User.active == 1)\
-            .filter(User.institution_id == user_institution_id)\
-            .count()
-
-        new_users = User.query\
-            .filter(User.institution_id == user_institution_id)\
-            .order_by(User.id.desc())\
-            .limit(5)\
-            .all()
-
-        last_seven_days = [datetime.today() - timedelta(days=i)
-                           for i in range(0, 7)]
-
-        attendances = []
-        for day in last_seven_days:
-            count = 0
-            day_str = day.strftime("%Y-%m-%d")
-            day_query = Attendance.query\
-                .filter(Attendance.date == day_str)\
-                .filter(Attendance.present == 0).all()
-
-            # Check if user belongs to current institution_id
-            for query in day_query:
-                user = User.query\
-                    .filter(User.id == query.user_id).first()
-
-                if user is not None:
-                    count += 1
-
-            absent_json = {
-                "day": day_str,
-                "absent": count
-            }
+        result = home_stats_cache.get_or_compute(
+            user_institution_id, get_home_stats)
 
-            attendances.append(absent_json)
+        # Per user, so it is not part of the institution stats in cache
+        result = dict(result, unread=total_unread(claims['id']))
 
-        all_photos = Image.query\
-            .filter(Image.institution_id == user_institution_id).count()
+        return jsonify(result)
 
-        news_query = News.query\
-            .filter(News.institution_id == user_institution_id)\
-            .order_by(News.created_at.desc())\
-            .limit(5).all()
 
-        news_loads = news_schema.dump(news_query)
+def get_home_stats(institution_id):
+    """Compute the homepage stats of an institution.
+
+    Teachers and children are counted by one conditional aggregate and
+    the absence chart reads the daily attendance rollup, so the number
+    of statements does not depend on the size of attendance history.
+    """
+    num_of_teachers, num_of_children = db.session.query(
+        func.count(distinct(case((Role.title == "Teacher", User.id)))),
+        func.count(distinct(case((Role.title == "Child", User.id)))))\
+        .select_from(User)\
+        .join(User.roles)\
+        .filter(User.active == 1)\
+        .filter(User.institution_id == institution_id)\
+        .one()
+
+    new_users = User.query\
+        .filter(User.institution_id == institution_id)\
+        .order_by(User.id.desc())\
+        .limit(5)\
+        .all()
+
+    today = date.today()
+    last_seven_days = [today - timedelta(days=i) for i in range(0, 7)]
+
+    absent_by_day = db.session.query(
+        AttendanceDaily.date, AttendanceDaily.absent_count)\
+        .filter(AttendanceDaily.institution_id == institution_id)\
+        .filter(AttendanceDaily.group_id == INSTITUTION_WIDE)\
+        .filter(AttendanceDaily.date >= last_seven_days[-1])\
+        .filter(AttendanceDaily.date <= today)\
+        .all()
+    absent_by_day = dict(absent_by_day)
+
+    attendances = []
+    for day in last_seven_days:
+        absent_json = {
+            "day": day.strftime("%Y-%m-%d"),
+            "absent": absent_by_day.get(day, 0)
+        }
 
-        new_users_result = user_home_schema.dump(new_users)
+        attendances.append(absent_json)
 
-        result = {
-            "teachers": num_of_teachers,
-            "children": num_of_children,
-            "new_users": new_users_result,
-            "images": all_photos,
-            "absence": attendances,
-            "news": news_loads
-        }
+    all_photos = Image.query\
+        .filter(Image.institution_id == institution_id).count()
 
-        return jsonify(result)
+    news_query = News.query\
+        .filter(News.institution_id == institution_id)\
+        .order_by(News.created_at.desc())\
+        .limit(5).all()
+
+    news_loads = news_schema.dump(news_query)
+
+    new_users_result = user_home_schema.dump(new_users)
+
+    return {
+        "teachers": num_of_teachers,
+        "children": num_of_children,
+        "new_users": new_users_result,
+        "images": all_photos,
+        "absence": attendances,
+        "news": news_loads
+    }
@@ -0,0 +1,49 @@
+from flask import g
+from flask_jwt_extended import get_jwt
+from database.db import db
+from database.models import User
+
+
+class Identity(object):
+    """The logged user as described by the claims of the access token.
+
+    `id`, `email`, `institution_id` and `roles` come from the claims
+    LoginApi put in the token, so reading them does not touch the
+    database. The `User` row is loaded on the first use of `user`.
+    """
+
+    def __init__(self, claims):
+        self.claims = claims
+        self.id = claims['id']
+        self.email = claims['email']
+        self.institution_id = claims['institution_id']
+        self.roles = [r['title'] for r in claims['roles']]
+        self._user = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.query.get(self.id)
+
+        return self._user
+
+    def exists(self):
+        """Check the user still exists, reading only the primary key"""
+        if self._user is not None:
+            return True
+
+        return db.session.query(User.id).filter_by(id=self.id)\
+            .first() is not None
+
+
+def current_identity():
+    """Return the Identity of the current request, needs @jwt_required"""
+    claims = get_jwt()
+
+    # Cached per decoded token, an app context can outlive one request
+    identity = g.get('_current_identity')
+    if identity is None or identity.claims is not claims:
+        identity = Identity(claims)
+        g._current_identity = identity
+
+    return identity
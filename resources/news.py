@@ -8,6 +8,7 @@ from flask_jwt_extended import (
 )
 from flask_restful_swagger_2 import Api, swagger, Resource, Schema
 from .swagger_models import News as NewsSwaggerModel
+from .identity import current_identity
 from datetime import datetime
 import math
 
@@ -147,19 +148,16 @@ class NewsMApi(Resource):
     @jwt_required()
     def post(self):
         """Add a new news"""
-        claims = get_jwt()
-        user_institution_id = claims['institution_id']
-        user_roles = claims['roles']
-        user_id = claims['id']
+        current_user = current_identity()
 
         title = request.json['title']
         details = request.json['details']
         priority = request.json['priority']
-        institution_id = user_institution_id
-        author_id = user_id
+        institution_id = current_user.institution_id
+        author_id = current_user.id
 
-        for r in user_roles:
-            if(r['title'] != "Teacher" and r['title'] != "Admin"):
+        for role in current_user.roles:
+            if(role != "Teacher" and role != "Admin"):
                 return jsonify({'msg': 'Insufficient permissions'})
 
         created_at = db.func.current_timestamp()
@@ -169,8 +167,8 @@ class NewsMApi(Resource):
         if not institution:
             return jsonify({'msg': 'Institution does not exist'})
 
-        author = User.query.get(author_id)
-        if not author:
+        # The token can outlive its user
+        if not current_user.exists():
             return jsonify({'msg': 'Author/User does not exist'})
 
         new_news = News(title, details, priority, created_at,
@@ -0,0 +1,57 @@
+from flask import request
+
+import math
+
+MIN_PER_PAGE = 5
+MAX_PER_PAGE = 30
+DEFAULT_PER_PAGE = 15
+
+
+def get_page_args():
+    """Return (page, per_page) from the query string.
+
+    Follows the rules of the other paginated endpoints: page defaults to 1
+    and per_page defaults to 15, clamped to [5, 30].
+    """
+    page = request.args.get('page')
+    per_page = request.args.get('per_page')
+
+    if page is None or int(page) < 1:
+        page = 1
+
+    if per_page is None:
+        per_page = DEFAULT_PER_PAGE
+
+    per_page = min(max(int(per_page), MIN_PER_PAGE), MAX_PER_PAGE)
+
+    return int(page), per_page
+
+
+def get_page_bounds(total):
+    """Return (page, per_page, last_page, offset) for `total` items"""
+    page, per_page = get_page_args()
+    last_page = math.ceil(total / per_page)
+
+    if page >= last_page:
+        page = max(last_page, 1)
+
+    return page, per_page, last_page, (page - 1) * per_page
+
+
+def paginate(query, schema):
+    """Run a paginated `query` and return the usual pagination dict
+
+    `schema` has to be created with many=True.
+    """
+    total = query.order_by(None).count()
+    page, per_page, last_page, offset = get_page_bounds(total)
+
+    items = query.offset(offset).limit(per_page).all()
+
+    return {
+        "total": total,
+        "per_page": per_page,
+        "current_page": page,
+        "last_page": last_page,
+        "data": schema.dump(items)
+    }
@@ -7,17 +7,24 @@ from .roles import RolesApi, RoleApi, UserRoleApi, UserRolesApi
 from .groups import (
     GroupApi, GroupsApi, UserGroupsApi, UserGroupApi, UserGroupFilterApi
 )
-from .activities import ActivitiesApi, ActivityApi, GroupActivitiesApi
+from .activities import (
+    ActivitiesApi, ActivityApi, GroupActivitiesApi, ActivityHistoryApi,
+    ActivityBatchApi
+)
 from .dishes import DishApi, DishesApi, DishMenuApi, DishMenusApi
 from .conversations import (
     ConversationsApi, ConversationReplyApi, ConversationRepliesApi,
-    UserSearchApi
+    UserSearchApi, PushQueueStatsApi, EventStreamApi, EventStreamTokenApi,
+    ConversationReadApi, ConversationSearchApi, GroupBroadcastApi
 )
 from .images import ImageApi, ImagesApi
 from .news import NewsApi, NewsMApi
 from .albums import (AlbumApi, AlbumsApi, AlbumImageApi,
                      AlbumImagesApi, DeleteAlbumImageApi)
-from .attendance import AttendanceMApi, AttendanceApi
+from .attendance import (
+    AttendanceMApi, AttendanceApi, GroupAttendanceApi, AttendanceReportApi,
+    AttendanceExportApi
+)
 from .home import HomeStatsApi
 
 
@@ -34,6 +41,8 @@ def initialize_routes(api):
     api.add_resource(ActivitiesApi, '/activity')
     api.add_resource(ActivityApi, '/activity/<id>')
     api.add_resource(GroupActivitiesApi, '/group_activity')
+    api.add_resource(ActivityHistoryApi, '/activity_history/<id>')
+    api.add_resource(ActivityBatchApi, '/activity_batch')
 
     api.add_resource(RolesApi, '/role')
     api.add_resource(RoleApi, '/role/<id>')
@@ -54,7 +63,13 @@ def initialize_routes(api):
     api.add_resource(ConversationsApi, '/conversation')
     api.add_resource(ConversationReplyApi, '/conversation_reply')
     api.add_resource(ConversationRepliesApi, '/conversation_reply/<conv_id>')
+    api.add_resource(ConversationReadApi, '/conversation_read/<conv_id>')
+    api.add_resource(ConversationSearchApi, '/conversation_search')
+    api.add_resource(GroupBroadcastApi, '/group_broadcast')
     api.add_resource(UserSearchApi, '/search_user')
+    api.add_resource(PushQueueStatsApi, '/push_queue')
+    api.add_resource(EventStreamApi, '/events')
+    api.add_resource(EventStreamTokenApi, '/events_token')
 
     api.add_resource(LoginApi, '/login')
     api.add_resource(RefreshTokenApi, '/refresh')
@@ -74,4 +89,7 @@ def initialize_routes(api):
 
     api.add_resource(AttendanceMApi, '/attendance')
     api.add_resource(AttendanceApi, '/attendance/<id>')
+    api.add_resource(GroupAttendanceApi, '/group_attendance')
+    api.add_resource(AttendanceReportApi, '/attendance_report')
+    api.add_resource(AttendanceExportApi, '/attendance_export')
 
@@ -2,8 +2,8 @@ from flask_marshmallow import Marshmallow
 from database.db import db
 from database.models import (
     User, Institution, Role, Group,
-    Activity, Dish, DishMenu, Conversation,
-    ConversationReply, Image, News,
+    Activity, ActivityHistory, Dish, DishMenu, Conversation,
+    ConversationReply, ConversationParticipant, Image, News,
     Attendance, Album
 )
 from flask import Flask, render_template, jsonify, request
@@ -88,6 +88,15 @@ class ActivitySchema(ma.Schema):
     activity_user = ma.Nested('UserLookupSchema', many=False, data_key='user')
 
 
+class ActivityHistorySchema(ma.Schema):
+    class Meta:
+        model = ActivityHistory
+        ordered = True
+        fields = ("date", "sleep", "food_scale")
+
+    date = ma.DateTime('%Y-%m-%d')
+
+
 class DishSchema(ma.Schema):
     class Meta:
         model = Dish
@@ -107,17 +116,27 @@ class ConversationSchema(ma.Schema):
     class Meta:
         model = Conversation
         ordered = True
-        fields = ("id", "user_one", "user_two", "conversation_replies")
+        fields = ("id", "user_one", "user_two", "title", "participants",
+                  "conversation_replies")
     conversation_replies = ma.Nested(
         'ConversationReplySchema', many=True)
+    participants = ma.Nested(
+        'ConversationParticipantSchema', many=True)
+
+
+class ConversationParticipantSchema(ma.Schema):
+    class Meta:
+        model = ConversationParticipant
+        ordered = True
+        fields = ("user_id", "last_read_at", "unread_count")
 
 
 class ConversationLastSchema(ma.Schema):
     class Meta:
         model = Conversation
         ordered = True
-        fields = ("id", "created_at", "updated_at",
-                  "user_two_obj", "conversation_replies")
+        fields = ("id", "title", "created_at", "updated_at",
+                  "unread_count", "user_two_obj", "conversation_replies")
 
     conversation_replies = ma.Nested(
         'ConversationReplyLastSchema', many=True, data_key='last_reply')
@@ -130,7 +149,7 @@ class ConversationReplyLastSchema(ma.Schema):
     class Meta:
         model = ConversationReply
         ordered = True
-        fields = ("id", "reply", "reply_time",
+        fields = ("id", "reply", "preview", "reply_time",
                   "reply_user_id")
     # reply_user = ma.Nested('UserNestedSchema', many=False)
 
@@ -144,6 +163,14 @@ class ConversationReplySchema(ma.Schema):
     # reply_user = ma.Nested('UserNestedSchema', many=False)
 
 
+class ConversationReplySearchSchema(ma.Schema):
+    class Meta:
+        model = ConversationReply
+        ordered = True
+        fields = ("id", "conv_id", "reply_user_id", "reply_time",
+                  "snippet", "rank")
+
+
 class UserNestedSchema(ma.Schema):
     class Meta:
         model = User
@@ -142,6 +142,31 @@ class Activity(Schema):
     required = ['sleep', 'food_scale']
 
 
+class ActivityBatch(Schema):
+    type = 'object'
+    description = 'Must provide these when editing activities of many users'
+    properties = {
+        'activities': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {
+                        'type': 'integer'
+                    },
+                    'sleep': {
+                        'type': 'integer'
+                    },
+                    'food_scale': {
+                        'type': 'integer'
+                    }
+                }
+            }
+        }
+    }
+    required = ['activities']
+
+
 class DishMenu(Schema):
     type = 'object'
     description = 'Must provide these when creating dish menu'
@@ -179,13 +204,23 @@ class Dish(Schema):
 
 class Conversation(Schema):
     type = 'object'
-    description = 'Must provide these when creating new conversation'
+    description = '''Must provide these when creating new conversation. \
+        Group conversations are created with `participants` (and an \
+        optional `title`) instead of `user_two`'''
     properties = {
         'user_two': {
             'type': 'integer'
         },
+        'participants': {
+            'type': 'array',
+            'items': {
+                'type': 'integer'
+            }
+        },
+        'title': {
+            'type': 'string'
+        },
     }
-    required = ['user_two']
 
 
 class ConversationReply(Schema):
@@ -288,6 +323,35 @@ class Attendance(Schema):
     required = ['date', 'present']
 
 
+class GroupAttendance(Schema):
+    type = 'object'
+    description = 'Must provide these when adding attendance for a whole group'
+    properties = {
+        'group_id': {
+            'type': 'integer'
+        },
+        'date': {
+            'type': 'string',
+            'format': 'date'
+        },
+        'attendances': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'user_id': {
+                        'type': 'integer'
+                    },
+                    'present': {
+                        'type': 'integer'
+                    }
+                }
+            }
+        }
+    }
+    required = ['group_id', 'date', 'attendances']
+
+
 class PasswordChange(Schema):
     type = 'object'
     description = 'Must provide these when changing password'
@@ -313,6 +377,20 @@ class UserLookup(Schema):
     required = ['name_like']
 
 
+class GroupBroadcast(Schema):
+    type = 'object'
+    description = 'Reply sent to every member of a group'
+    properties = {
+        'group_id': {
+            'type': 'integer'
+        },
+        'reply': {
+            'type': 'string'
+        }
+    }
+    required = ['group_id', 'reply']
+
+
 class GroupActivityLookup(Schema):
     type = 'object'
     description = 'Must provide when doing user lookup'
@@ -12,6 +12,7 @@ from .swagger_models import Login as LoginSwaggerModel
 from .swagger_models import PasswordChange as PasswordChangeSwaggerModel
 from flask_sqlalchemy import SQLAlchemy
 from .security import generate_salt, generate_hash
+from .identity import current_identity
 
 import math
 import datetime
@@ -448,10 +449,7 @@ class PasswordChangeApi(Resource):
     @jwt_required()
     def post(self):
         """Changes current user password"""
-        claims_jwt = get_jwt()
-        claims_id = claims_jwt['id']
-
-        current_user = User.query.get(claims_id)
+        current_user = current_identity().user
 
         password = request.json['password']
         password_repeat = request.json['repeat_password']
@@ -1,20 +1,85 @@
 from flask_apscheduler import APScheduler
-from database.models import Activity
-from database.db import db
+from sqlalchemy import func, literal, select
+from database.models import Activity, ActivityHistory, User
+from database.db import db, upsert_from_select
+from datetime import date, timedelta
+
+import time
 
 scheduler = APScheduler()
 
 
+def _institution_users(institution_id):
+    return select(User.id).where(User.institution_id == institution_id)
+
+
+def snapshot_activities(day, institution_id=None):
+    """Copy current activities into activity_history as values of `day`.
+
+    Done with a single INSERT ... SELECT. Running it twice for the same
+    day overwrites the first snapshot. Returns the number of rows copied.
+    """
+    snapshot = select(Activity.user_id, literal(day), Activity.sleep,
+                      Activity.food_scale)\
+        .where(Activity.user_id.isnot(None))
+
+    if institution_id is not None:
+        snapshot = snapshot.where(
+            Activity.user_id.in_(_institution_users(institution_id)))
+
+    count = db.session.execute(upsert_from_select(
+        ActivityHistory, ['user_id', 'date', 'sleep', 'food_scale'],
+        snapshot, ['user_id', 'date'], ['sleep', 'food_scale'])).rowcount
+    db.session.commit()
+
+    return count
+
+
+def reset_activities(institution_id=None, batch_size=None):
+    """Set sleep and food_scale of activities to 0 with bulk UPDATEs.
+
+    Optionally limited to one institution. With `batch_size` the table is
+    updated in id ranges of that size, each in its own transaction, to
+    keep locks short on big tables. Returns the number of updated rows.
+    """
+    activity = Activity.__table__
+    reset = activity.update().values(food_scale=0, sleep=0)
+
+    if institution_id is not None:
+        reset = reset.where(
+            activity.c.user_id.in_(_institution_users(institution_id)))
+
+    if batch_size is None:
+        count = db.session.execute(reset).rowcount
+        db.session.commit()
+        return count
+
+    min_id, max_id = db.session.execute(
+        select(func.min(activity.c.id), func.max(activity.c.id))).one()
+    if min_id is None:
+        return 0
+
+    count = 0
+    for start in range(min_id, max_id + 1, batch_size):
+        count += db.session.execute(reset.where(
+            activity.c.id.between(start, start + batch_size - 1))).rowcount
+        db.session.commit()
+
+    return count
+
+
 # For testing:
 # @scheduler.task('interval', id='do_job_1', seconds=5)
 @scheduler.task('cron', id='do_job_1', day_of_week='*')
 def job1():
     with scheduler.app.app_context():
-        all_activities = Activity.query.all()
-        for activity in all_activities:
-            activity.food_scale = 0
-            activity.sleep = 0
+        started = time.monotonic()
+
+        # The job runs at midnight, so the values belong to the day before
+        snapshot_activities(date.today() - timedelta(days=1))
 
-            db.session.commit()
+        count = reset_activities(
+            batch_size=scheduler.app.config.get('ACTIVITY_RESET_BATCH_SIZE'))
 
-        print("Activities cleared!")
+        print("Activities cleared! ({} rows in {:.2f}s)".format(
+            count, time.monotonic() - started))
@@ -5,6 +5,8 @@ import flask_restful
 from flask import Flask
 
 from tests.test_base import TestBase
+from database.db import db
+from database.models import Activity, User
 
 
 class TestActivities(TestBase):
@@ -190,6 +192,14 @@ class TestActivities(TestBase):
             '/group_activity?group=testgroup', headers=self.header)
         data = json.loads(response.get_data(as_text=True))
 
+        self.assertEqual(1, len(data))
+        self.assertEqual(2, data[0]['user']['id'])
+
+        response_by_id = self.app.get(
+            '/group_activity?group_id=1', headers=self.header)
+        self.assertEqual(data, json.loads(
+            response_by_id.get_data(as_text=True)))
+
         # expected = [
         #     {
         #         'id': 1,
@@ -202,3 +212,83 @@ class TestActivities(TestBase):
         self.assertEqual(200, response.status_code)
         # self.assertEqual(data, expected)
 
+
+    def test_get_child_activity_group_not_exists(self):
+        response = self.app.get(
+            '/group_activity?group=nogroup', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Group doesnt exist")
+
+    def test_get_activity_only_own_institution(self):
+        user_data = {
+            "email": "another_one",
+            "password": "string",
+            "firstname": "string",
+            "surname": "string",
+            "sex": 0,
+            "active": 0
+        }
+        self.app.post(
+            '/user',
+            data=json.dumps(user_data),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        curr_time = db.func.current_timestamp()
+        other_user = User("other", "string", "string", "string", "string",
+                          2, 0, 1, curr_time, curr_time)
+        other_user.activity = Activity(0, 0)
+        db.session.add(other_user)
+        db.session.commit()
+
+        response = self.app.get('/activity', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual([2], [a['user']['id'] for a in data])
+
+        response = self.app.get('/activity?page=1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(1, data['total'])
+        self.assertEqual(2, data['data'][0]['user']['id'])
+
+    def test_update_activities_batch(self):
+        for email in ("first", "second"):
+            user_data = {
+                "email": email,
+                "password": "string",
+                "firstname": "string",
+                "surname": "string",
+                "sex": 0,
+                "active": 0
+            }
+            self.app.post(
+                '/user',
+                data=json.dumps(user_data),
+                content_type='application/json',
+                headers=self.header
+            )
+
+        batch_data = {
+            "activities": [
+                {"user_id": 2, "sleep": 1, "food_scale": 2},
+                {"user_id": 3, "sleep": 3, "food_scale": 4},
+                {"user_id": 50, "sleep": 1, "food_scale": 1}
+            ]
+        }
+        response = self.app.put(
+            '/activity_batch',
+            data=json.dumps(batch_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(
+            ["updated", "updated", "not_found"], [a['status'] for a in data])
+        self.assertEqual(
+            [(1, 2), (3, 4)],
+            [(a.sleep, a.food_scale)
+             for a in Activity.query.order_by(Activity.user_id).all()])
@@ -0,0 +1,333 @@
+import json
+import time
+import unittest
+import flask_restful
+from flask import Flask
+from datetime import date
+
+from tests.test_base import TestBase
+from database.db import db
+from sqlalchemy import text
+from database.models import Attendance, AttendanceDaily, User
+from database.rollup import refresh_attendance_rollup
+from database.attendance import (
+    create_attendance_unique_index, remove_duplicate_attendances
+)
+
+# Tests for endpoints:
+# - /attendance
+
+
+class TestAttendance(TestBase):
+
+    def add_attendance(self, date_str, present):
+        return self.app.post(
+            '/attendance',
+            data=json.dumps({"date": date_str, "present": present}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+    def add_other_institution_user(self):
+        curr_time = db.func.current_timestamp()
+        other_user = User("other", "string", "string", "string", "string",
+                          2, 0, 1, curr_time, curr_time)
+        db.session.add(other_user)
+        db.session.commit()
+
+        return other_user
+
+    def test_get_unauthorized_attendance_route(self):
+        response = self.app.get('/attendance')
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Missing Authorization Header")
+        self.assertEqual(401, response.status_code)
+
+    def test_add_attendance(self):
+        result = self.add_attendance("2021-05-10", 1)
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("2021-05-10", data['date'])
+        self.assertEqual(1, data['user']['id'])
+
+    def test_add_attendance_already_exists(self):
+        self.add_attendance("2021-05-10", 1)
+        result = self.add_attendance("2021-05-10", 0)
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Attendance for this date already exists")
+
+    def test_get_attendances_only_current_institution(self):
+        self.add_attendance("2021-05-10", 1)
+        other_user = self.add_other_institution_user()
+        db.session.add(Attendance(date(2021, 5, 10), 0, other_user.id))
+        db.session.commit()
+
+        response = self.app.get('/attendance', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(data))
+        self.assertEqual(1, data[0]['user']['id'])
+
+    def test_get_attendances_by_date(self):
+        self.add_attendance("2021-05-10", 1)
+        self.add_attendance("2021-05-11", 0)
+
+        response = self.app.get(
+            '/attendance?date=2021-05-11&only_me=true', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(1, len(data))
+        self.assertEqual("2021-05-11", data[0]['date'])
+
+    def test_get_attendances_paginated(self):
+        for day in range(1, 8):
+            self.add_attendance("2021-05-{:02d}".format(day), 1)
+
+        response = self.app.get(
+            '/attendance?page=2&per_page=5', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(7, data['total'])
+        self.assertEqual(2, data['last_page'])
+        self.assertEqual(
+            ["2021-05-06", "2021-05-07"], [a['date'] for a in data['data']])
+
+    def add_group_with_child(self):
+        user_data = {
+            "email": "child",
+            "password": "string",
+            "firstname": "string",
+            "surname": "string",
+            "sex": 0,
+            "active": 1
+        }
+        self.app.post(
+            '/user',
+            data=json.dumps(user_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        self.app.post(
+            '/group',
+            data=json.dumps({"name": "testgroup"}),
+            content_type='application/json',
+            headers=self.header
+        )
+        self.app.post(
+            '/usergroup',
+            data=json.dumps({"group_id": 1, "user_id": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+    def add_group_attendance(self, attendances):
+        group_data = {
+            "group_id": 1,
+            "date": "2021-05-10",
+            "attendances": attendances
+        }
+
+        return self.app.post(
+            '/group_attendance',
+            data=json.dumps(group_data),
+            content_type='application/json',
+            headers=self.header
+        )
+
+    def test_add_group_attendance(self):
+        self.add_group_with_child()
+
+        result = self.add_group_attendance([{"user_id": 2, "present": 0}])
+        data = json.loads(result.get_data(as_text=True))
+        self.assertEqual(1, data['count'])
+
+        # Saving the same day again overwrites the stored value
+        self.add_group_attendance([{"user_id": 2, "present": 1}])
+
+        attendances = Attendance.query.filter(Attendance.user_id == 2).all()
+        self.assertEqual(1, len(attendances))
+        self.assertEqual(1, attendances[0].present)
+
+    def test_add_group_attendance_not_member(self):
+        self.add_group_with_child()
+
+        result = self.add_group_attendance([{"user_id": 1, "present": 1}])
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Users do not belong to given group")
+        self.assertEqual([1], data['user_ids'])
+
+    def test_update_attendance_to_existing_date(self):
+        self.add_attendance("2021-05-10", 1)
+        self.add_attendance("2021-05-11", 1)
+
+        update_data = {
+            "date": "2021-05-10",
+            "present": 0,
+            "user_id": 1
+        }
+        result = self.app.put(
+            '/attendance/2',
+            data=json.dumps(update_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Attendance for this date already exists")
+
+    def test_get_attendance_report_keyset(self):
+        for day in range(1, 8):
+            self.add_attendance("2021-05-{:02d}".format(day), 1)
+
+        response = self.app.get(
+            '/attendance_report?from=2021-05-02&to=2021-05-06&per_page=3',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(
+            ["2021-05-02", "2021-05-03", "2021-05-04"],
+            [a['date'] for a in data['data']])
+        self.assertIsNotNone(data['next_cursor'])
+
+        response = self.app.get(
+            '/attendance_report?from=2021-05-02&to=2021-05-06&per_page=3'
+            '&after=' + data['next_cursor'],
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(
+            ["2021-05-05", "2021-05-06"], [a['date'] for a in data['data']])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_get_attendance_report_by_group(self):
+        self.add_group_with_child()
+        self.add_group_attendance([{"user_id": 2, "present": 0}])
+        self.add_attendance("2021-05-10", 1)
+
+        response = self.app.get(
+            '/attendance_report?group_id=1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual([2], [a['user']['id'] for a in data['data']])
+
+    def test_attendance_rollup_follows_writes(self):
+        self.add_group_with_child()
+        self.add_group_attendance([{"user_id": 2, "present": 0}])
+        self.add_attendance("2021-05-10", 1)
+
+        rollup = AttendanceDaily.query\
+            .order_by(AttendanceDaily.group_id).all()
+        self.assertEqual(
+            [(0, 1, 1), (1, 0, 1)],
+            [(r.group_id, r.present_count, r.absent_count) for r in rollup])
+
+        self.app.delete('/attendance/1', headers=self.header)
+
+        rollup = AttendanceDaily.query\
+            .order_by(AttendanceDaily.group_id).all()
+        self.assertEqual(
+            [(0, 1, 0)],
+            [(r.group_id, r.present_count, r.absent_count) for r in rollup])
+
+    def test_attendance_rollup_follows_group_changes(self):
+        self.add_group_with_child()
+        self.add_group_attendance([{"user_id": 2, "present": 0}])
+
+        def group_counts():
+            return [(r.present_count, r.absent_count)
+                    for r in AttendanceDaily.query.filter_by(group_id=1)]
+
+        self.assertEqual([(0, 1)], group_counts())
+
+        usergroup = json.dumps({"group_id": 1, "user_id": 2})
+        self.app.delete('/usergroup', data=usergroup,
+                        content_type='application/json', headers=self.header)
+        self.assertEqual([], group_counts())
+
+        self.app.post('/usergroup', data=usergroup,
+                      content_type='application/json', headers=self.header)
+        self.assertEqual([(0, 1)], group_counts())
+
+    def test_attendance_rollup_overwrites_existing_row(self):
+        # Stale counts of the day, and of a day without attendance
+        db.session.add(AttendanceDaily(1, 0, date(2021, 5, 10), 7, 7))
+        db.session.add(AttendanceDaily(1, 0, date(2021, 5, 11), 3, 0))
+        db.session.commit()
+
+        response = self.add_attendance("2021-05-10", 1)
+        self.assertEqual(200, response.status_code)
+
+        rollup = AttendanceDaily.query.all()
+        self.assertEqual(
+            [(date(2021, 5, 10), 1, 0)],
+            [(r.date, r.present_count, r.absent_count) for r in rollup
+             if r.date == date(2021, 5, 10)])
+
+        refresh_attendance_rollup(1)
+        db.session.commit()
+
+        self.assertEqual([date(2021, 5, 10)],
+                         [r.date for r in AttendanceDaily.query.all()])
+
+    def test_export_attendance_csv(self):
+        self.add_attendance("2021-05-10", 1)
+        self.add_attendance("2021-05-11", 0)
+
+        response = self.app.get(
+            '/attendance_export?from=2021-05-11', headers=self.header)
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response.mimetype)
+        self.assertEqual(
+            ['id,date,present,user_id,email,firstname,surname',
+             '2,2021-05-11,0,1,testuser,string,string'], lines)
+
+    def test_export_attendance_ndjson(self):
+        self.add_attendance("2021-05-10", 1)
+
+        response = self.app.get(
+            '/attendance_export?format=ndjson', headers=self.header)
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertEqual(1, len(lines))
+        self.assertEqual("2021-05-10", json.loads(lines[0])['date'])
+
+    def test_attendance_unique_index_on_new_database(self):
+        self.add_attendance("2021-05-10", 1)
+        self.add_attendance("2021-05-11", 0)
+
+        # New databases get the constraint from create_all()
+        self.assertEqual(0, remove_duplicate_attendances())
+        self.assertFalse(create_attendance_unique_index())
+        self.assertEqual(2, Attendance.query.count())
+
+    def test_attendance_unique_index_on_old_table(self):
+        db.session.commit()
+        Attendance.__table__.drop(db.engine)
+        db.session.execute(text(
+            'CREATE TABLE attendance (id INTEGER PRIMARY KEY, '
+            'date DATE NOT NULL, present INTEGER NOT NULL, '
+            'user_id INTEGER NOT NULL)'))
+        for attendance_id, present in ((1, 0), (2, 1)):
+            db.session.execute(text(
+                "INSERT INTO attendance VALUES (:id, '2021-05-10', :p, 1)"),
+                {'id': attendance_id, 'p': present})
+
+        self.assertEqual(1, remove_duplicate_attendances())
+        self.assertTrue(create_attendance_unique_index())
+        db.session.commit()
+
+        self.assertEqual([(2, 1)], [
+            (a.id, a.present) for a in Attendance.query.all()])
+
+        # The upsert finds the index
+        result = self.add_attendance("2021-05-10", 0)
+        data = json.loads(result.get_data(as_text=True))
+        self.assertEqual(data['msg'], "Attendance for this date already exists")
+
@@ -5,6 +5,15 @@ import flask_restful
 from flask import Flask
 
 from tests.test_base import TestBase
+from database.db import db
+from database.models import Conversation, ConversationReply, ConversationParticipant
+from database.conversations import (
+    fill_conversation_pairs, migrate_participants, refresh_last_replies
+)
+from database.push import push_queue
+from database.events import event_hub
+from resources.conversations import record_replies
+from datetime import datetime
 
 # Tests for endpoints:
 # - /conversation
@@ -112,6 +121,7 @@ class TestConversations(TestBase):
         data = json.loads(second_query.get_data(as_text=True))
 
         self.assertEqual(data['msg'], "Conversation already exists")
+        self.assertEqual(1, data['conversation']['id'])
         self.assertEqual(200, second_query.status_code)
 
     def test_add_conversation_with_yourself(self):
@@ -162,6 +172,34 @@ class TestConversations(TestBase):
             data['msg'], "No matching names")
         self.assertEqual(200, query.status_code)
 
+    def test_search_ignores_diacritics_and_order(self):
+        user_data = {
+            "email": "lukasz",
+            "password": "string",
+            "firstname": "Łukasz",
+            "surname": "Żak",
+            "sex": 0,
+            "active": 0,
+            "institution_id": 1
+        }
+        self.app.post(
+            '/user',
+            data=json.dumps(user_data),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        for name_like in ("lukasz z", "ŻAK Łu", "zak"):
+            query = self.app.post(
+                '/search_user',
+                data=json.dumps({"name_like": name_like}),
+                content_type='application/json',
+                headers=self.header
+            )
+            data = json.loads(query.get_data(as_text=True))
+
+            self.assertEqual(["lukasz"], [u['email'] for u in data])
+
     def test_get_unauthorized_conversation_reply_route(self):
         response = self.app.get('/conversation_reply/1')
         data = json.loads(response.get_data(as_text=True))
@@ -219,3 +257,533 @@ class TestConversations(TestBase):
         )
 
         self.assertEqual(200, reply_result.status_code)
+
+        # The reply is pushed to the other user only
+        push_queue.join()
+        events = push_queue.client.events
+        self.assertEqual(['2'], [e['channel'] for e in events])
+        self.assertEqual("string", events[0]['data']['reply'])
+
+    def test_get_conversations_last_reply(self):
+        user_data = {
+            "email": "string",
+            "password": "string",
+            "firstname": "second",
+            "surname": "string",
+            "sex": 0,
+            "active": 0,
+            "institution_id": 1
+        }
+        self.app.post(
+            '/user',
+            data=json.dumps(user_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        db.session.add(ConversationReply(
+            "first", datetime(2021, 5, 10, 10, 0), 1, 1))
+        db.session.add(ConversationReply(
+            "last", datetime(2021, 5, 10, 11, 0), 2, 1))
+        db.session.commit()
+        refresh_last_replies()
+        db.session.commit()
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(1, data['total'])
+        conversation = data['data'][0]
+        self.assertEqual(2, conversation['user_two']['id'])
+        self.assertEqual("second", conversation['user_two']['firstname'])
+        self.assertEqual(1, len(conversation['last_reply']))
+        self.assertEqual("last", conversation['last_reply'][0]['reply'])
+        self.assertEqual("last", conversation['last_reply'][0]['preview'])
+        self.assertEqual(2, conversation['last_reply'][0]['reply_user_id'])
+
+    def add_users(self, *names):
+        for name in names:
+            user_data = {
+                "email": name,
+                "password": "string",
+                "firstname": name,
+                "surname": "string",
+                "sex": 0,
+                "active": 0,
+                "institution_id": 1
+            }
+            self.app.post(
+                '/user',
+                data=json.dumps(user_data),
+                content_type='application/json',
+                headers=self.header
+            )
+
+    def test_add_group_conversation(self):
+        self.add_users("second", "third")
+
+        conversation_data = {
+            "participants": [1, 2, 3],
+            "title": "Group"
+        }
+        result = self.app.post(
+            '/conversation',
+            data=json.dumps(conversation_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("Group", data['title'])
+        self.assertEqual([1, 2, 3], sorted(
+            p['user_id'] for p in data['participants']))
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(1, data['total'])
+        self.assertEqual("Group", data['data'][0]['title'])
+        self.assertIsNone(data['data'][0]['user_two'])
+
+    def test_add_group_conversation_user_not_exists(self):
+        self.add_users("second")
+
+        result = self.app.post(
+            '/conversation',
+            data=json.dumps({"participants": [2, 50]}),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "User with given id does not exist")
+
+    def test_get_replies_not_participant(self):
+        self.add_users("second", "third")
+
+        db.session.add(Conversation(2, 3, datetime(2021, 5, 10),
+                                    datetime(2021, 5, 10)))
+        db.session.commit()
+        migrate_participants()
+        db.session.commit()
+
+        self.assertEqual(2, ConversationParticipant.query.count())
+
+        response = self.app.get('/conversation_reply/1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Conversation does not exist")
+
+    def add_replies(self, count):
+        self.add_users("second")
+        self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        # Same reply_time for all, the id breaks the tie
+        for i in range(count):
+            db.session.add(ConversationReply(
+                str(i), datetime(2021, 5, 10, 10, 0), 1, 1))
+        db.session.commit()
+
+    def test_get_replies_before_id(self):
+        self.add_replies(8)
+
+        response = self.app.get(
+            '/conversation_reply/1?before_id=8&per_page=5',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertTrue(data['has_more'])
+        self.assertEqual([7, 6, 5, 4, 3], [r['id'] for r in data['data']])
+
+        response = self.app.get(
+            '/conversation_reply/1?before_id=3&per_page=5',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertFalse(data['has_more'])
+        self.assertEqual([2, 1], [r['id'] for r in data['data']])
+
+    def test_get_replies_after_id(self):
+        self.add_replies(3)
+
+        response = self.app.get(
+            '/conversation_reply/1?after_id=1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertFalse(data['has_more'])
+        self.assertEqual([2, 3], [r['id'] for r in data['data']])
+
+    def test_get_replies_since(self):
+        self.add_replies(2)
+        db.session.add(ConversationReply(
+            "new", datetime(2021, 5, 10, 12, 0), 2, 1))
+        db.session.commit()
+
+        response = self.app.get(
+            '/conversation_reply/1?since=2021-05-10T11:00:00',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(["new"], [r['reply'] for r in data['data']])
+
+    def test_get_replies_since_id(self):
+        # Replies 1 to 3 are sent in the same second
+        self.add_replies(3)
+
+        response = self.app.get(
+            '/conversation_reply/1?since=2021-05-10T10:00:00&since_id=1',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual([2, 3], [r['id'] for r in data['data']])
+
+    def test_get_replies_since_with_offset(self):
+        self.add_replies(2)
+        db.session.add(ConversationReply(
+            "new", datetime(2021, 5, 10, 12, 0), 2, 1))
+        db.session.commit()
+
+        for since in ("2021-05-10T11:00:00Z", "2021-05-10T13:00:00+02:00"):
+            response = self.app.get(
+                '/conversation_reply/1?since=' + since.replace('+', '%2B'),
+                headers=self.header)
+            data = json.loads(response.get_data(as_text=True))
+
+            self.assertEqual(["new"], [r['reply'] for r in data['data']])
+
+    def stream_token(self):
+        response = self.app.post('/events_token', headers=self.header)
+        return json.loads(response.get_data(as_text=True))['token']
+
+    def test_event_stream(self):
+        token = self.stream_token()
+        response = self.app.get('/events?jwt=' + token, buffered=False)
+        stream = iter(response.response)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+        self.assertEqual(b': connected\n\n', next(stream))
+
+        event_hub.publish(['2'], 'my-event', {'reply': 'not mine'})
+        event_hub.publish(['1'], 'my-event', {'reply': 'hi'})
+
+        self.assertEqual(
+            b'event: my-event\ndata: {"reply": "hi"}\n\n', next(stream))
+        response.close()
+
+    def test_event_stream_needs_stream_token(self):
+        token = self.header['Authorization'].split()[1]
+        response = self.app.get('/events?jwt=' + token)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Use a token from /events_token")
+
+    def test_reply_saved_when_event_publish_fails(self):
+        self.add_replies(0)
+
+        class BrokenFanout(object):
+            def start(self, hub):
+                pass
+
+            def publish(self, hub, message):
+                raise RuntimeError('NOTIFY failed')
+
+        fanout = event_hub.fanout
+        event_hub.fanout = BrokenFanout()
+        try:
+            response = self.app.post(
+                '/conversation_reply',
+                data=json.dumps({"reply": "hi", "conv_id": 1}),
+                content_type='application/json',
+                headers=self.header
+            )
+        finally:
+            event_hub.fanout = fanout
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, ConversationReply.query.count())
+
+    def test_event_stream_limit(self):
+        token = self.stream_token()
+        max_subscriptions = event_hub.max_subscriptions
+        event_hub.max_subscriptions = 1
+        try:
+            first = self.app.get('/events?jwt=' + token, buffered=False)
+
+            second = self.app.get('/events?jwt=' + token, buffered=False)
+            data = json.loads(second.get_data(as_text=True))
+            self.assertEqual(data['msg'], "Too many open event streams")
+
+            # Closing a stream frees its place
+            first.close()
+            third = self.app.get('/events?jwt=' + token, buffered=False)
+            self.assertEqual('text/event-stream', third.mimetype)
+            third.close()
+        finally:
+            event_hub.max_subscriptions = max_subscriptions
+
+    def test_unread_counts(self):
+        self.add_users("second")
+        self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        for reply in ("first", "second"):
+            self.app.post(
+                '/conversation_reply',
+                data=json.dumps({"reply": reply, "conv_id": 1}),
+                content_type='application/json',
+                headers=self.header
+            )
+
+        self.assertEqual(2, ConversationParticipant.query.get(
+            (1, 2)).unread_count)
+        self.assertEqual(0, ConversationParticipant.query.get(
+            (1, 1)).unread_count)
+
+        # Replies of the other user are unread until marked as read
+        ConversationParticipant.query.get((1, 1)).unread_count = 4
+        db.session.commit()
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(4, data['data'][0]['unread_count'])
+        self.assertEqual("second", data['data'][0]['last_reply'][0]['reply'])
+
+        response = self.app.put('/conversation_read/1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(
+            data['msg'], "Successfully marked conversation as read")
+        self.assertEqual(0, ConversationParticipant.query.get(
+            (1, 1)).unread_count)
+
+    def test_inbox_last_reply_full_text(self):
+        self.add_replies(0)
+        long_reply = "Zebranie " * 30
+        self.app.post(
+            '/conversation_reply',
+            data=json.dumps({"reply": long_reply, "conv_id": 1}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        last_reply = data['data'][0]['last_reply'][0]
+
+        self.assertEqual(long_reply, last_reply['reply'])
+        self.assertEqual(long_reply[:Conversation.PREVIEW_LENGTH],
+                         last_reply['preview'])
+
+    def test_inbox_ordered_by_last_reply(self):
+        self.add_users("second", "third")
+        for user_two in (2, 3):
+            self.app.post(
+                '/conversation',
+                data=json.dumps({"user_two": user_two}),
+                content_type='application/json',
+                headers=self.header
+            )
+
+        reply = ConversationReply("late", datetime(2030, 1, 1), 2, 1)
+        db.session.add(reply)
+        db.session.flush()
+        record_replies([reply], 2)
+        db.session.commit()
+
+        self.assertEqual(datetime(2030, 1, 1), ConversationParticipant.query.get(
+            (1, 1)).last_reply_at)
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual([1, 2], [c['id'] for c in data['data']])
+
+    def test_mark_read_not_participant(self):
+        response = self.app.put('/conversation_read/1', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Conversation does not exist")
+
+    def test_search_replies(self):
+        self.add_users("second", "third")
+        for user_one, user_two in ((1, 2), (2, 3)):
+            conversation = Conversation(user_one, user_two,
+                                        datetime(2021, 5, 10),
+                                        datetime(2021, 5, 10))
+            conversation.participants = [
+                ConversationParticipant(None, user_one),
+                ConversationParticipant(None, user_two)]
+            db.session.add(conversation)
+
+        for reply, conv_id in (("Kto pytał o formularz alergii?", 1),
+                               ("Formularz jest w szatni", 1),
+                               ("Obiad o 12", 1),
+                               ("Formularz nie dla mnie", 2)):
+            db.session.add(ConversationReply(
+                reply, datetime(2021, 5, 10, 10, 0), 2, conv_id))
+        db.session.commit()
+
+        response = self.app.get(
+            '/conversation_search?q=formularz&per_page=1',
+            headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(1, len(data['data']))
+        self.assertIn('<em>', data['data'][0]['snippet'])
+        first_id = data['data'][0]['id']
+
+        response = self.app.get(
+            '/conversation_search?q=formularz&per_page=1&after=' +
+            data['next_cursor'], headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        # Only replies of conversations of the user are found
+        self.assertEqual({1, 2}, {first_id, data['data'][0]['id']})
+        self.assertIsNone(data['next_cursor'])
+
+        response = self.app.get(
+            '/conversation_search?q=ALERGII', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual([1], [r['id'] for r in data['data']])
+
+    def test_search_replies_escapes_snippet(self):
+        self.add_replies(0)
+        db.session.add(ConversationReply(
+            'formularz <img src=x onerror="alert(1)">',
+            datetime(2021, 5, 10, 10, 0), 2, 1))
+        db.session.commit()
+
+        response = self.app.get(
+            '/conversation_search?q=formularz', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        snippet = data['data'][0]['snippet']
+        self.assertIn('<em>formularz</em>', snippet)
+        self.assertNotIn('<img', snippet)
+        self.assertIn('&lt;img', snippet)
+
+    def test_conversation_exists_other_way_round(self):
+        self.add_users("second")
+        self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        # Conversation started by the other user
+        conversation = Conversation.query.get(1)
+        conversation.user_one, conversation.user_two = 2, 1
+        db.session.commit()
+
+        response = self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Conversation already exists")
+        self.assertEqual(1, Conversation.query.count())
+
+    def test_fill_conversation_pairs(self):
+        self.add_users("second")
+        for user_one, user_two in ((2, 1), (1, 2)):
+            conversation = Conversation(user_one, user_two,
+                                        datetime(2021, 5, 10),
+                                        datetime(2021, 5, 10))
+            conversation.pair_low = conversation.pair_high = None
+            db.session.add(conversation)
+        db.session.commit()
+
+        self.assertEqual(1, fill_conversation_pairs())
+        db.session.commit()
+
+        conversation = Conversation.query.get(1)
+        self.assertEqual((1, 2), (conversation.pair_low,
+                                  conversation.pair_high))
+        self.assertIsNone(Conversation.query.get(2).pair_low)
+
+    def test_group_broadcast(self):
+        self.add_users("second", "third")
+        self.app.post(
+            '/group',
+            data=json.dumps({"name": "testgroup"}),
+            content_type='application/json',
+            headers=self.header
+        )
+        for user_id in (1, 2, 3):
+            self.app.post(
+                '/usergroup',
+                data=json.dumps({"user_id": user_id, "group_id": 1}),
+                content_type='application/json',
+                headers=self.header
+            )
+
+        # Conversation with the second user already exists
+        self.app.post(
+            '/conversation',
+            data=json.dumps({"user_two": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        response = self.app.post(
+            '/group_broadcast',
+            data=json.dumps({"group_id": 1, "reply": "Zebranie o 17"}),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Successfully sent reply to the group")
+        self.assertEqual(2, data['count'])
+        self.assertEqual(2, Conversation.query.count())
+        self.assertEqual(1, ConversationParticipant.query.get(
+            (1, 2)).unread_count)
+        self.assertEqual(1, ConversationParticipant.query.get(
+            (2, 3)).unread_count)
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(["Zebranie o 17", "Zebranie o 17"],
+                         [c['last_reply'][0]['reply'] for c in data['data']])
+
+        push_queue.join()
+        events = sorted(push_queue.client.events, key=lambda e: e['channel'])
+        self.assertEqual(['2', '3'], [e['channel'] for e in events])
+        self.assertEqual([(1, 1), (2, 2)], [
+            (e['data']['conv_id'], e['data']['id']) for e in events])
+        self.assertEqual(
+            ConversationReply.query.get(1).reply_time.isoformat(),
+            events[0]['data']['reply_time'])
+
+    def test_group_broadcast_group_not_exists(self):
+        response = self.app.post(
+            '/group_broadcast',
+            data=json.dumps({"group_id": 5, "reply": "string"}),
+            content_type='application/json',
+            headers=self.header
+        )
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Group doesnt exist")
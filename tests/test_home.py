@@ -0,0 +1,139 @@
+import json
+import time
+import unittest
+import flask_restful
+from flask import Flask
+from datetime import date, datetime, timedelta
+
+from tests.test_base import TestBase
+from database.db import db
+from database.models import (
+    Attendance, User, News, Conversation, ConversationParticipant
+)
+from database.rollup import refresh_attendance_rollup
+from database.cache import home_stats_cache
+
+
+class TestHome(TestBase):
+
+    def test_get_unauthorized_home_route(self):
+        response = self.app.get('/home')
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Missing Authorization Header")
+        self.assertEqual(401, response.status_code)
+
+    def test_get_home_route(self):
+        response = self.app.get('/home', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            list(data.keys()),
+            ["teachers", "children", "new_users", "images", "absence", "news",
+             "unread"])
+        self.assertEqual(7, len(data['absence']))
+        self.assertEqual(date.today().strftime("%Y-%m-%d"),
+                         data['absence'][0]['day'])
+
+    def test_home_counts_roles_and_absence(self):
+        user_data = {
+            "email": "child",
+            "password": "string",
+            "firstname": "string",
+            "surname": "string",
+            "sex": 0,
+            "active": 1
+        }
+        self.app.post(
+            '/user',
+            data=json.dumps(user_data),
+            content_type='application/json',
+            headers=self.header
+        )
+        self.app.post(
+            '/role',
+            data=json.dumps({"title": "Child"}),
+            content_type='application/json',
+            headers=self.header
+        )
+        self.app.post(
+            '/userrole',
+            data=json.dumps({"role_id": 1, "user_id": 2}),
+            content_type='application/json',
+            headers=self.header
+        )
+
+        # Absent user from another institution must not be counted
+        curr_time = db.func.current_timestamp()
+        other_user = User("other", "string", "string", "string", "string",
+                          2, 0, 1, curr_time, curr_time)
+        db.session.add(other_user)
+        db.session.commit()
+
+        yesterday = date.today() - timedelta(days=1)
+        db.session.add(Attendance(yesterday, 0, 2))
+        db.session.add(Attendance(yesterday, 0, other_user.id))
+        db.session.add(Attendance(date.today(), 1, 2))
+        db.session.commit()
+        refresh_attendance_rollup()
+        db.session.commit()
+
+        response = self.app.get('/home', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, data['teachers'])
+        self.assertEqual(1, data['children'])
+        self.assertEqual(0, data['absence'][0]['absent'])
+        self.assertEqual(1, data['absence'][1]['absent'])
+
+    def test_home_cache_invalidated_on_write(self):
+        response = self.app.get('/home', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual([], data['news'])
+
+        curr_time = db.func.current_timestamp()
+        db.session.add(News("Jakiś post", "Tutaj jest jakiś dłuuuugi opis.",
+                            True, curr_time, curr_time, 1, 1))
+        db.session.commit()
+
+        response = self.app.get('/home', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(1, len(data['news']))
+
+    def test_home_cache_skips_result_of_old_generation(self):
+        def compute(institution_id):
+            # A write committed while the stats were computed
+            home_stats_cache.invalidate(institution_id)
+            return {'news': []}
+
+        home_stats_cache.get_or_compute(1, compute)
+
+        self.assertIsNone(home_stats_cache.backend.get(1))
+
+    def test_home_cache_invalidated_on_institution_change(self):
+        db.session.commit()
+        home_stats_cache.backend.set(1, {'children': 0})
+        home_stats_cache.backend.set(2, {'children': 0})
+
+        User.query.get(1).institution_id = 2
+        db.session.commit()
+
+        self.assertIsNone(home_stats_cache.backend.get(1))
+        self.assertIsNone(home_stats_cache.backend.get(2))
+
+    def test_home_unread(self):
+        for conv_id, unread in ((1, 2), (2, 3)):
+            conversation = Conversation(1, None, datetime(2021, 5, 10),
+                                        datetime(2021, 5, 10))
+            participant = ConversationParticipant(None, 1)
+            participant.unread_count = unread
+            conversation.participants = [participant]
+            db.session.add(conversation)
+        db.session.commit()
+
+        response = self.app.get('/home', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(5, data['unread'])
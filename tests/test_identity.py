@@ -0,0 +1,77 @@
+import json
+import unittest
+
+from flask_jwt_extended import create_access_token, verify_jwt_in_request
+
+from tests.test_base import TestBase
+from database.db import db
+from database.models import Attendance, Institution, News
+from resources.identity import current_identity
+
+
+class TestIdentity(TestBase):
+
+    def request_with(self, header):
+        return self.app.application.test_request_context(headers=header)
+
+    def test_identity_from_claims(self):
+        with self.request_with(self.header):
+            verify_jwt_in_request()
+            identity = current_identity()
+
+            self.assertEqual(1, identity.id)
+            self.assertEqual(1, identity.institution_id)
+            self.assertIs(identity, current_identity())
+            self.assertEqual("testuser", identity.user.email)
+
+    def test_identity_per_token(self):
+        claims = {"id": 2, "email": "other", "institution_id": 2,
+                  "roles": [{"title": "Teacher"}]}
+        token = create_access_token(identity=claims,
+                                    additional_claims=claims)
+        other_header = {'Authorization': 'Bearer {}'.format(token)}
+
+        # Both requests share the app context pushed by the test
+        with self.request_with(self.header):
+            verify_jwt_in_request()
+            self.assertEqual(1, current_identity().id)
+
+        with self.request_with(other_header):
+            verify_jwt_in_request()
+            self.assertEqual(2, current_identity().id)
+            self.assertEqual(["Teacher"], current_identity().roles)
+
+    def deleted_user_header(self):
+        claims = {"id": 50, "email": "deleted", "institution_id": 1,
+                  "roles": []}
+        token = create_access_token(identity=claims,
+                                    additional_claims=claims)
+        return {'Authorization': 'Bearer {}'.format(token)}
+
+    def test_news_of_deleted_user(self):
+        db.session.add(Institution("test", "test", "test", "123"))
+        db.session.commit()
+
+        result = self.app.post(
+            '/news',
+            data=json.dumps({"title": "title", "details": "details",
+                             "priority": True}),
+            content_type='application/json',
+            headers=self.deleted_user_header()
+        )
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "Author/User does not exist")
+        self.assertEqual(0, News.query.count())
+
+    def test_attendance_of_deleted_user(self):
+        result = self.app.post(
+            '/attendance',
+            data=json.dumps({"date": "2021-05-10", "present": 1}),
+            content_type='application/json',
+            headers=self.deleted_user_header()
+        )
+        data = json.loads(result.get_data(as_text=True))
+
+        self.assertEqual(data['msg'], "User does not exist")
+        self.assertEqual(0, Attendance.query.count())
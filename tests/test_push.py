@@ -0,0 +1,59 @@
+import unittest
+
+from flask import Flask
+from database.push import FakePusher, PushQueue
+
+
+class FlakyPusher(FakePusher):
+    """Fails the first `failures` batches"""
+
+    failures = 1
+
+    def trigger_batch(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Pusher is down')
+
+        super().trigger_batch(batch)
+
+
+class TestPushQueue(unittest.TestCase):
+
+    def make_queue(self, **config):
+        app = Flask(__name__)
+        app.config.update(PUSHER_CLIENT='database.push.FakePusher',
+                          PUSH_QUEUE_BACKOFF=0)
+        app.config.update(config)
+
+        push_queue = PushQueue()
+        push_queue.init_app(app)
+        return push_queue
+
+    def test_publish_to_many_channels(self):
+        push_queue = self.make_queue()
+
+        push_queue.publish(['1', '2', '3'], 'my-event', {'reply': 'hi'})
+        push_queue.join()
+
+        self.assertEqual(['1', '2', '3'], sorted(
+            e['channel'] for e in push_queue.client.events))
+        self.assertEqual(3, push_queue.stats()['sent'])
+        self.assertEqual(0, push_queue.stats()['depth'])
+
+    def test_retry_failed_batch(self):
+        push_queue = self.make_queue(
+            PUSHER_CLIENT='tests.test_push.FlakyPusher')
+
+        push_queue.publish('1', 'my-event', {})
+        push_queue.join()
+
+        self.assertEqual(1, len(push_queue.client.events))
+        self.assertEqual(1, push_queue.stats()['retried'])
+
+    def test_drop_when_full(self):
+        push_queue = self.make_queue(PUSH_QUEUE_SIZE=1, PUSH_QUEUE_WORKERS=0)
+
+        push_queue.publish(['1', '2'], 'my-event', {})
+
+        self.assertEqual(1, push_queue.stats()['depth'])
+        self.assertEqual(1, push_queue.stats()['dropped'])
@@ -0,0 +1,66 @@
+import json
+import time
+import unittest
+import flask_restful
+from flask import Flask
+
+from tests.test_base import TestBase
+from database.db import db
+from database.models import Activity, ActivityHistory, User
+from scheduler import reset_activities, snapshot_activities
+from datetime import date
+
+
+class TestScheduler(TestBase):
+
+    def add_user_with_activity(self, email, institution_id):
+        curr_time = db.func.current_timestamp()
+        user = User(email, "string", "string", "string", "string",
+                    institution_id, 0, 1, curr_time, curr_time)
+        user.activity = Activity(3, 4)
+        db.session.add(user)
+        db.session.commit()
+
+    def test_reset_activities(self):
+        for i in range(5):
+            self.add_user_with_activity("user{}".format(i), 1)
+
+        count = reset_activities()
+
+        self.assertEqual(5, count)
+        self.assertEqual(
+            [(0, 0)] * 5,
+            [(a.sleep, a.food_scale) for a in Activity.query.all()])
+
+    def test_reset_activities_batched_per_institution(self):
+        for i in range(5):
+            self.add_user_with_activity("user{}".format(i), 1)
+        self.add_user_with_activity("other", 2)
+
+        count = reset_activities(institution_id=1, batch_size=2)
+
+        self.assertEqual(5, count)
+        self.assertEqual(
+            [0, 0, 0, 0, 0, 3],
+            [a.sleep for a in Activity.query.order_by(Activity.id).all()])
+
+    def test_snapshot_activities(self):
+        self.add_user_with_activity("user", 1)
+
+        snapshot_activities(date(2021, 5, 10))
+        reset_activities()
+        # Second snapshot of the same day replaces the first one
+        snapshot_activities(date(2021, 5, 11))
+        snapshot_activities(date(2021, 5, 11))
+
+        history = ActivityHistory.query.order_by(ActivityHistory.date).all()
+        self.assertEqual(
+            [(date(2021, 5, 10), 3, 4), (date(2021, 5, 11), 0, 0)],
+            [(h.date, h.sleep, h.food_scale) for h in history])
+
+        response = self.app.get(
+            '/activity_history/2?from=2021-05-11', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+
+        self.assertEqual(
+            [{"date": "2021-05-11", "sleep": 0, "food_scale": 0}], data)
@@ -0,0 +1,58 @@
+import json
+import unittest
+
+from sqlalchemy import inspect, text
+
+from tests.test_base import TestBase
+from database.db import db
+from database.schema import upgrade_schema
+
+# Tests for `flask upgrade-schema`
+
+
+class TestSchema(TestBase):
+
+    def upgrade(self):
+        with db.engine.begin() as connection:
+            return upgrade_schema(connection)
+
+    def columns(self, table):
+        return {c['name'] for c in inspect(db.engine).get_columns(table)}
+
+    def test_upgrade_new_database(self):
+        db.session.commit()
+
+        self.assertEqual([], self.upgrade())
+
+    def test_upgrade_old_tables(self):
+        db.session.commit()
+
+        # Tables as they were before the new columns
+        for statement in (
+                'DROP INDEX ix_user_institution_id_search_first_last',
+                'DROP INDEX ix_user_institution_id_search_last_first',
+                'ALTER TABLE user DROP COLUMN search_first_last',
+                'ALTER TABLE user DROP COLUMN search_last_first',
+                'DROP TABLE conversation',
+                'CREATE TABLE conversation (id INTEGER PRIMARY KEY, '
+                'user_one INTEGER, user_two INTEGER, '
+                'created_at DATETIME NOT NULL, '
+                'updated_at DATETIME NOT NULL)'):
+            db.session.execute(text(statement))
+        db.session.commit()
+
+        added = self.upgrade()
+
+        self.assertIn('user.search_first_last', added)
+        self.assertIn('conversation.pair_low', added)
+        self.assertIn('uq_conversation_pair', added)
+        self.assertIn('ix_user_institution_id_search_last_first', added)
+        self.assertTrue({'search_first_last', 'search_last_first'} <=
+                        self.columns('user'))
+        self.assertTrue({'last_reply_at', 'pair_low', 'pair_high', 'title'} <=
+                        self.columns('conversation'))
+        self.assertEqual([], self.upgrade())
+
+        response = self.app.get('/conversation', headers=self.header)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(0, data['total'])